@@ -1,154 +1,428 @@
 import collections
+import functools
 import math
+import operator
+import re
+import types
+import numpy as np
 
 Op = collections.namedtuple('Op', ['left', 'op', 'right'])
+Interval = collections.namedtuple('Interval', ['low', 'high', 'partial'], defaults=[False])  # see interval()
 OPS = (('+', '-'), ('*', '/'), '^')
+VAR_IDX = {'x': 0, 'y': 1, 'z': 2}
+# a number, a name (ex. x or math.pow), '**' or one char operator, comma, or paren, after any whitespace
+TOKEN_PATTERN = re.compile(r'\s*(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|[A-Za-z_][\w.]*|\*\*|[-+*/^(),]|$)')
+# func name: (op it's parsed to, right side if only one arg given)
+FUNCS = {'math.pow': ('pow', None), 'pow': ('pow', None), 'math.sqrt': ('pow', '0.5'),
+         'math.log': ('log', 'math.e')}
+SOLVE_CACHE_SIZE = 1024
+MATH_CONSTANTS = {'math.e': math.e, 'math.pi': math.pi}
+FOLD_OPS = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv,
+            '^': operator.pow, 'pow': math.pow, 'log': math.log}
 
 
 class EquationError(Exception):
     pass
 
 
-def paren_args(expr: str, i: int) -> (str, int):  # consider replacing '()' with ' ' and splitting to find next time
-    """ Returns contents of parentheses starting at expr[i] if '(' is at expr[i], else ''. """
-    if expr[i] == '(':
-        paren_tracker = 1
-        start = i + 1
-
-        while True:
-            i += 1
-            if expr[i] == '(':
-                paren_tracker += 1
-            elif expr[i] == ')':
-                paren_tracker -= 1
-
-            if paren_tracker == 0 or i >= len(expr) - 1:
+def _tokenize(expr: str) -> [str]:
+    """ Splits expr into numbers, names (ex. 'x', 'math.pow'), operators, parentheses and commas in one pass. """
+    tokens = []
+    i = 0
+    while i < len(expr):
+        match = TOKEN_PATTERN.match(expr, i)
+        if match is None:
+            raise EquationError(f'Unexpected character {expr[i]!r} in {expr!r}.')
+        if match.group(1):
+            tokens += [match.group(1)]
+        i = match.end()
+    return tokens
+
+
+def _expect(tokens: [str], i: int, token: str) -> int:
+    """ Index past tokens[i], provided tokens[i] is token. """
+    if i >= len(tokens) or tokens[i] != token:
+        raise EquationError(f'Expected {token!r} in {" ".join(tokens)!r}.')
+    return i + 1
+
+
+def _parse_sum(tokens: [str], i: int) -> (str or Op, int):
+    """ sum := product (('+' | '-') product)*, going >>left to right>> """
+    left, i = _parse_product(tokens, i)
+    while i < len(tokens) and tokens[i] in ('+', '-'):
+        op = tokens[i]
+        right, i = _parse_product(tokens, i + 1)
+        left = Op(left, op, right)
+    return left, i
+
+
+def _parse_product(tokens: [str], i: int) -> (str or Op, int):
+    """ product := unary (('*' | '/') unary)*, going >>left to right>> """
+    left, i = _parse_unary(tokens, i)
+    while i < len(tokens) and tokens[i] in ('*', '/'):
+        op = tokens[i]
+        right, i = _parse_unary(tokens, i + 1)
+        left = Op(left, op, right)
+    return left, i
+
+
+def _parse_unary(tokens: [str], i: int) -> (str or Op, int):
+    """ unary := ('-' | '+') unary | power, where -a is stored as 0-a """
+    if i < len(tokens) and tokens[i] == '-':
+        operand, i = _parse_unary(tokens, i + 1)
+        return Op('0', '-', operand), i
+    if i < len(tokens) and tokens[i] == '+':
+        return _parse_unary(tokens, i + 1)
+    return _parse_power(tokens, i)
+
+
+def _parse_power(tokens: [str], i: int) -> (str or Op, int):
+    """ power := atom (('^' | '**') unary)?, going <<right to left<< """
+    base, i = _parse_atom(tokens, i)
+    if i < len(tokens) and tokens[i] in ('^', '**'):
+        exponent, i = _parse_unary(tokens, i + 1)
+        return Op(base, '^', exponent), i
+    return base, i
+
+
+def _parse_atom(tokens: [str], i: int) -> (str or Op, int):
+    """ atom := '(' sum ')' | func '(' sum (',' sum)? ')' | number | name """
+    if i >= len(tokens):
+        raise EquationError(f'Expression {" ".join(tokens)!r} ends early.')
+
+    token = tokens[i]
+    if token == '(':
+        inner, i = _parse_sum(tokens, i + 1)
+        return inner, _expect(tokens, i, ')')
+
+    if token in FUNCS and i + 1 < len(tokens) and tokens[i + 1] == '(':
+        args = []
+        i += 1
+        while not args or tokens[i] == ',':
+            arg, i = _parse_sum(tokens, i + 1)
+            args += [arg]
+            if i >= len(tokens):
                 break
+        i = _expect(tokens, i, ')')
 
-        return expr[start: i], i
-    else:
-        return '', i
+        op, default_right = FUNCS[token]
+        if len(args) == 1 and default_right is not None:
+            args += [default_right]
+        if len(args) != 2:
+            raise EquationError(f'Wrong number of arguments for {token}.')
+        return Op(args[0], op, args[1]), i
 
+    if token in ('+', '-', '*', '/', '^', '**', ')', ','):
+        raise EquationError(f'Unexpected {token!r} in {" ".join(tokens)!r}.')
+    return token, i + 1
 
-def _list_values(expr: str) -> [str]:  # consider just not parsing sections w/o var to begin w/, then won't need unparse
-    """ Parses expr into a list, taking parentheses contents out and separating operators from operands. """
-    values = []
-    simple_value = ''
 
-    i = 0
-    while i < len(expr):  # and True not in [expression.startswith(key, i) for key in OPS[ops_idx]]:
-        if expr[i] == '(':
-            in_paren, i = paren_args(expr, i)
-            values += [in_paren.strip()]
-            i += 1
-        elif expr[i] in ['+', '-', '*', '/', '^']:
-            values += [expr[i]]
-            i += 1
-        else:
-            while i < len(expr) and expr[i] not in ['(', '+', '-', '*', '/', '^']:
-                simple_value += expr[i]
-                i += 1
-            values += [simple_value.strip()]
-            simple_value = ''
-    return values
-
-
-def _parse_expr(expr: str) -> Op:
-    """ Recursively creates a parsed version of expr using Op(eration) namedtuple. """
-    op_vals = _list_values(expr)
-    while len(op_vals) == 1 and True in [key in op_vals[0] for key in ['(', '+', '-', '*', '/', '^']]:
-        op_vals = _list_values(op_vals[0])
-
-    for ops in ['^', ('*', '/'), ('+', '-')]:
-        # exponents go <<right to left<< first, but everything else goes >>left to right>> first
-        if ops == '^':
-            i = len(op_vals) - 1
-            compare_idx = '0 <= i'
-            step = -1
-        else:
-            i = 0
-            compare_idx = 'i < len(op_vals)'
-            step = 1
-
-        while eval(compare_idx):
-            unary_minus = i == 0 and op_vals[0] == '-' and ops == ('+', '-')
-            if i + 1 < len(op_vals) and (type(op_vals[i + 1]) == str and op_vals[i + 1] in ops or unary_minus):
-                if unary_minus:
-                    l_val = '0'
-                    r_val = op_vals[1]
-                    op = '-'
-                    len_operation = 2
-                else:
-                    l_val = op_vals[i]
-                    r_val = op_vals[i + 2]
-                    op = op_vals[i + 1]
-                    len_operation = 3
-
-                if type(l_val) == str and True in [key in l_val for key in ['(', '+', '-', '*', '/', '^']]:
-                    l_val = _parse_expr(l_val)
-
-                if type(r_val) == str and True in [key in r_val for key in ['(', '+', '-', '*', '/', '^']]:
-                    r_val = _parse_expr(r_val)
-
-                op_vals[i: i + len_operation] = [Op(l_val, op, r_val)]
-                i -= step
-            i += step
-    return op_vals[0]
+def _parse_expr(expr: str) -> str or Op:
+    """ Creates a parsed version of expr using Op(eration) namedtuple, with a single pass tokenizer and parser. """
+    tokens = _tokenize(expr)
+    parsed_expr, i = _parse_sum(tokens, 0)
+    if i != len(tokens):
+        raise EquationError(f'Unexpected {tokens[i]!r} in {expr!r}.')
+    return parsed_expr
 
 
 def _unparse(parsed_expr: str or Op) -> str:
-    """ Unparses an expression that was parsed using parse_expr() back to a str. """
+    """ Unparses an expression that was parsed using parse_expr() back to a str python can read. """
     if type(parsed_expr) == str:
-        return parsed_expr
-    return f'({_unparse(parsed_expr.left)}{parsed_expr.op}{_unparse(parsed_expr.right)})'
+        return f'({parsed_expr})' if parsed_expr.startswith('-') else parsed_expr  # folded negative number
+
+    left = _unparse(parsed_expr.left)
+    right = _unparse(parsed_expr.right)
+    if parsed_expr.op == '-' and parsed_expr.left == '0':
+        return f'(-{right})'
+    elif parsed_expr.op == '^':
+        return f'({left}**{right})'
+    elif parsed_expr.op == 'pow':
+        return f'math.pow({left}, {right})'
+    elif parsed_expr.op == 'log':
+        return f'math.log({left}, {right})'
+    return f'({left}{parsed_expr.op}{right})'
+
+
+def _path_to_var(parsed_expr: str or Op, var: str) -> [(Op, bool)] or None:
+    """ Ops from parsed_expr down to var, each with whether var is on its left, or None if var isn't in it. """
+    if type(parsed_expr) == str:
+        return [] if parsed_expr == var else None
+
+    for var_on_left, side in ((True, parsed_expr.left), (False, parsed_expr.right)):
+        path = _path_to_var(side, var)
+        if path is not None:
+            return [(parsed_expr, var_on_left)] + path
+    return None
 
 
-def _solving(solution: str, parsed_var_side: str or Op, var: str):
+def _solving(solution: str or Op, path: [(Op, bool)]) -> str or Op:
     """
-    Uses parsed expression (parsed_var_side) and string
-    expression (solution) to find the solution to var recursively.
+    Undoes each Op along path (from _path_to_var) on the parsed other
+    side of the equation (solution), leaving the solution for var. A
+    '?' Op marks a root that's both positive and negative.
     """
-    if type(parsed_var_side) == str:  # or, parsed_var_side == var
-        return solution
-    else:
-        if var in _unparse(parsed_var_side.left):  # '+', '-', '*', '/', '^'
-            if parsed_var_side.op == '+':
-                solution += f'-{_unparse(parsed_var_side.right)}'
+    for parsed_var_side, var_on_left in path:
+        left, op, right = parsed_var_side
+        if var_on_left:
+            if op == '+':
+                solution = Op(solution, '-', right)
+            elif op == '-':
+                solution = Op(solution, '+', right)
+            elif op == '*':
+                solution = Op(solution, '/', right)
+            elif op == '/':  # consider adding my own division by 0 error?
+                solution = Op(solution, '*', right)
+            elif op == 'log':
+                solution = Op(right, 'pow', solution)
+            else:  # if op == '^' or op == 'pow':
+                solution = Op('0', '?', Op(solution, 'pow', Op('1', '/', right)))
+
+        else:  # if var is on the right
+            if op == '+':
+                solution = Op(solution, '-', left)
+            elif op == '-':
+                solution = Op(left, '-', solution)
+            elif op == '*':
+                solution = Op(solution, '/', left)
+            elif op == '/':  # consider adding a division by 0 error
+                solution = Op(left, '/', solution)
+            elif op == 'log':
+                solution = Op(left, 'pow', Op('1', '/', solution))
+            else:  # if op == '^' or op == 'pow':
+                solution = Op(solution, 'log', left)
+    return solution
+
+
+def _expand_plus_or_minus(parsed_expr: str or Op) -> [str or Op]:
+    """ Every version of parsed_expr with each '?' Op taken as + then as -. """
+    if type(parsed_expr) == str:
+        return [parsed_expr]
+
+    rights = _expand_plus_or_minus(parsed_expr.right)
+    if parsed_expr.op == '?':
+        return rights + [Op('0', '-', right) for right in rights]
+    lefts = _expand_plus_or_minus(parsed_expr.left)
+    return [Op(left, parsed_expr.op, right) for right in rights for left in lefts]
+
+
+def _literal(parsed_expr: str or Op) -> int or float or None:
+    """ Value of parsed_expr if it's a number (or math constant), else None. """
+    if type(parsed_expr) != str:
+        return None
+    if parsed_expr in MATH_CONSTANTS:
+        return MATH_CONSTANTS[parsed_expr]
+    try:
+        return int(parsed_expr)
+    except ValueError:
+        try:
+            return float(parsed_expr)
+        except ValueError:
+            return None
+
+
+def _fold(left: int or float, op: str, right: int or float) -> str or None:
+    """ left op right as a number str, or None if it can't be worked out to a finite real number. """
+    try:
+        value = FOLD_OPS[op](left, right)
+        if type(value) not in [int, float] or not math.isfinite(value):  # big ints overflow turning into floats
+            return None
+    except (ValueError, ZeroDivisionError, OverflowError):
+        return None
+    return repr(value)
+
+
+def simplify(parsed_expr: str or Op) -> str or Op:
+    """
+    Folds constants and drops identities (x+0, x-0, x*1, x/1, x^1, --x)
+    bottom up, so fewer operations run each time the expression is evaluated.
+    Nothing that could raise for some x (like 0*x or x^0) is dropped.
+    """
+    if type(parsed_expr) == str:
+        return parsed_expr
 
-            elif parsed_var_side.op == '-':
-                solution += f'+{_unparse(parsed_var_side.right)}'
+    left = simplify(parsed_expr.left)
+    op = parsed_expr.op
+    right = simplify(parsed_expr.right)
+    left_value = _literal(left)
+    right_value = _literal(right)
 
-            elif parsed_var_side.op == '*':
-                solution = f'({solution})/{_unparse(parsed_var_side.right)}'
+    if left_value is not None and right_value is not None and op in FOLD_OPS:
+        folded = _fold(left_value, op, right_value)
+        if folded is not None:
+            return folded
 
-            elif parsed_var_side.op == '/':  # consider adding my own division by 0 error?
-                solution = f'({solution})*{_unparse(parsed_var_side.right)}'
+    if op == '+' and left_value == 0 or op == '*' and left_value == 1:
+        return right
+    if op in ('+', '-') and right_value == 0 or op in ('*', '/', '^', 'pow') and right_value == 1:
+        return left
+    if op == '-' and type(right) == Op and right.op == '-' and right.left == '0':
+        return simplify(Op(left, '+', right.right)) if left_value != 0 else right.right  # a - -b
+    if op == '+' and type(right) == Op and right.op == '-' and right.left == '0':
+        return Op(left, '-', right.right)  # a + -b
+    return Op(left, op, right)
 
-            else:  # if parsed_var_side.op == '^':
-                solution = f'(?math.pow(({solution}), (1/{_unparse(parsed_var_side.right)})))'
 
-            return _solving(solution, parsed_var_side.left, var)
+def _has_var(parsed_expr: str or Op, var: str) -> bool:
+    return _path_to_var(parsed_expr, var) is not None
 
-        else:  # if parsed_var_side.right.has_var:
-            if parsed_var_side.op == '+':
-                solution += f'-{_unparse(parsed_var_side.left)}'
 
-            elif parsed_var_side.op == '-':
-                solution = f'-({solution}-{_unparse(parsed_var_side.left)})'
+def _times(left: str or Op, right: str or Op) -> str or Op:
+    """ left * right, or 0 if either is 0 (fine for derivatives, where the other side is part of the same func). """
+    return '0' if left == '0' or right == '0' else Op(left, '*', right)
 
-            elif parsed_var_side.op == '*':
-                solution = f'({solution})/{_unparse(parsed_var_side.left)}'
 
-            elif parsed_var_side.op == '/':  # consider adding a division by 0 error
-                solution = f'{_unparse(parsed_var_side.left)}/({solution})'
+def differentiate(parsed_expr: str or Op, var: str) -> str or Op:
+    """ Simplified derivative of parsed_expr with respect to var, using the usual rules on each Op. """
+    if type(parsed_expr) == str:
+        return '1' if parsed_expr == var else '0'
+
+    left, op, right = parsed_expr
+    d_left = differentiate(left, var)
+    d_right = differentiate(right, var)
+
+    if op in ('+', '-'):
+        derivative = Op(d_left, op, d_right)
+    elif op == '*':
+        derivative = Op(_times(d_left, right), '+', _times(left, d_right))
+    elif op == '/':
+        numerator = simplify(Op(_times(d_left, right), '-', _times(left, d_right)))
+        derivative = '0' if numerator == '0' else Op(numerator, '/', Op(right, '^', '2'))
+    elif op == 'log':  # log(left, right) = ln(left) / ln(right)
+        if _has_var(right, var):
+            return differentiate(Op(Op(left, 'log', 'math.e'), '/', Op(right, 'log', 'math.e')), var)
+        derivative = '0' if d_left == '0' else Op(d_left, '/', _times(left, Op(right, 'log', 'math.e')))
+    elif not _has_var(right, var):  # power rule for '^' and 'pow'
+        derivative = _times(_times(right, Op(left, op, Op(right, '-', '1'))), d_left)
+    else:  # d(l^r) = l^r * (r' * ln(l) + r * l' / l)
+        derivative = _times(parsed_expr, Op(_times(d_right, Op(left, 'log', 'math.e')), '+',
+                                            '0' if d_left == '0' else Op(_times(right, d_left), '/', left)))
+    return simplify(derivative)
+
+
+def _product(a: float, b: float) -> float:
+    """ a * b, where 0 * inf is 0 like it is for the interval ends it's used on. """
+    return 0.0 if a == 0 or b == 0 else a * b
+
+
+def _interval_times(left: Interval, right: Interval) -> Interval:
+    products = [_product(a, b) for a in left[:2] for b in right[:2]]
+    return Interval(min(products), max(products), left.partial or right.partial)
+
+
+def _interval_divide(left: Interval, right: Interval) -> Interval or None:
+    partial = left.partial or right.partial
+    if right.low == right.high == 0:
+        return None
+    if right.low < 0 < right.high:
+        return Interval(-math.inf, math.inf, True)
+    if right.low == 0:  # can't divide by the 0 end, and the rest goes off to +/-inf
+        return _interval_times(left, Interval(1 / right.high, math.inf, True))
+    if right.high == 0:
+        return _interval_times(left, Interval(-math.inf, 1 / right.low, True))
+    return _interval_times(left, Interval(1 / right.high, 1 / right.low, partial))
+
+
+def _int_power(base: float, n: int) -> float:
+    """ base ** n for an int n >= 0, going to +/-inf instead of raising if it's too big. """
+    try:
+        return base ** n
+    except OverflowError:
+        return math.copysign(math.inf, base) if n % 2 == 1 else math.inf
+
 
-            else:  # if parsed_var_side.op == '^':
-                solution = f'math.log({solution}, {_unparse(parsed_var_side.left)})'
+def _power_or_inf(base: float, exponent: float) -> float:
+    """ base ** exponent for base >= 0, with 0 to a negative power (or anything too big) as inf. """
+    try:
+        return math.pow(base, exponent)
+    except (ValueError, OverflowError):
+        return math.inf
+
+
+def _interval_power(base: Interval, exponent: Interval) -> Interval or None:
+    partial = base.partial or exponent.partial
+    if exponent.low == exponent.high and float(exponent.low).is_integer():  # defined for negative bases too
+        n = int(exponent.low)
+        if n < 0:
+            return _interval_divide(Interval(1, 1), _interval_power(base, Interval(-n, -n, partial)))
+        ends = [_int_power(end, n) for end in base[:2]]
+        if n % 2 == 0 and base.low < 0 < base.high:
+            return Interval(0, max(ends), partial)
+        return Interval(min(ends), max(ends), partial)
+
+    if base.high < 0:  # a fractional power of a negative is invalid
+        return None
+    if base.low < 0:
+        base = Interval(0, base.high, True)
+    # for base >= 0, base ** exponent is monotonic along each edge of the (base, exponent) box
+    corners = [_power_or_inf(b, e) for b in base[:2] for e in exponent[:2]]
+    return Interval(min(corners), max(corners), partial or base.partial)
+
+
+def _interval_log(value: Interval, base: Interval) -> Interval or None:
+    if value.high <= 0 or base.high <= 0:
+        return None
+    ln_value = Interval(math.log(value.low) if value.low > 0 else -math.inf, math.log(value.high),
+                        value.partial or value.low <= 0)
+    ln_base = Interval(math.log(base.low) if base.low > 0 else -math.inf, math.log(base.high),
+                       base.partial or base.low <= 0)
+    return _interval_divide(ln_value, ln_base)
+
+
+def interval(parsed_expr: str or Op, box: {str: (float, float)}) -> Interval or None:
+    """
+    Guaranteed range of parsed_expr over box, a (low, high) range for each var. None means it's
+    invalid everywhere in box, and partial means it's only valid in some of box (the range covers
+    that part). Used to rule out whole regions before evaluating anything point by point.
+    """
+    if type(parsed_expr) == str:
+        if parsed_expr in box:
+            return Interval(*box[parsed_expr])
+        value = _literal(parsed_expr)
+        return Interval(value, value)
+
+    left = interval(parsed_expr.left, box)
+    right = interval(parsed_expr.right, box)
+    if left is None or right is None:
+        return None
+
+    op = parsed_expr.op
+    partial = left.partial or right.partial
+    if op == '+':
+        return Interval(left.low + right.low, left.high + right.high, partial)
+    elif op == '-':
+        return Interval(left.low - right.high, left.high - right.low, partial)
+    elif op == '*':
+        return _interval_times(left, right)
+    elif op == '/':
+        return _interval_divide(left, right)
+    elif op == 'log':
+        return _interval_log(left, right)
+    else:  # if op == '^' or op == 'pow':
+        return _interval_power(left, right)
+
+
+@functools.lru_cache(maxsize=SOLVE_CACHE_SIZE)
+def _solve_for(equation: str, var: str) -> (str or Op,) or None:
+    """ Cached, parsed and simplified solutions for solve_for, in a tuple so callers can't change them. """
+    # assume one '=' and one var
+    sides_of_equation = [_parse_expr(side) for side in equation.split('=')]
+    if len(sides_of_equation) != 2:
+        raise EquationError(f'Need exactly one \'=\' in {equation!r}.')
+
+    path = _path_to_var(sides_of_equation[0], var)
+    solution = sides_of_equation[1]
+    if path is None:
+        path = _path_to_var(sides_of_equation[1], var)
+        solution = sides_of_equation[0]
+        if path is None:
+            return None
 
-            return _solving(solution, parsed_var_side.right, var)
+    solution = _solving(solution, path)
+    return tuple(simplify(expr) for expr in _expand_plus_or_minus(solution))
 
 
-def solve_for(equation: str, var: str) -> str or None:
+def solve_for(equation: str, var: str) -> [str] or None:
     """
     Solves for var in equation in a way python can read using builtin
     math library, assuming equation has one occurrence of
@@ -157,43 +431,130 @@ def solve_for(equation: str, var: str) -> str or None:
     if var not in equation:
         return None  # consider throwing exception (and catching were called)
 
-    # assume one '=' and one var
-    sides_of_equation = equation.split('=')
-    if var in sides_of_equation[0]:
-        var_side = sides_of_equation[0]
-        solution = sides_of_equation[1]
-    else:
-        var_side = sides_of_equation[1]
-        solution = sides_of_equation[0]
+    solutions = _solve_for(equation, var)
+    return None if solutions is None else [_unparse(solution) for solution in solutions]
+
 
-    parsed_var_side = _parse_expr(var_side)
-    solution = _solving(solution, parsed_var_side, var)
+def _array_log(value, base=math.e):
+    """ math.log for arrays, NaN where math.log would raise instead of -inf or a warning. """
+    value = np.where(value > 0, value, np.nan)
+    base = np.where(base > 0, base, np.nan)
+    return np.log(value) / np.log(base)
 
-    return plus_or_minus(solution.replace('^', '**'))
 
+# stands in for the math module in compiled array funcs so the same solved expressions work elementwise
+ARRAY_MATH = types.SimpleNamespace(pow=np.float_power, log=_array_log, sqrt=np.sqrt, e=math.e, pi=math.pi)
 
-def plus_or_minus(expr: str) -> [str]:
-    if '?' in expr:
-        char_idx = expr.find('?')
-        plus_side = expr[:char_idx + 1].replace('?', '')
-        minus_side = expr[:char_idx + 1].replace('?', '-')
 
-        if '?' in expr[char_idx + 1:]:
-            list_of_exprs = []
-            for rest_of_expr in plus_or_minus(expr[char_idx + 1:]):
-                list_of_exprs += [plus_side + rest_of_expr, minus_side + rest_of_expr]
-            return list_of_exprs
+def _subexprs(parsed_expr: str or Op) -> {Op}:
+    """ Every distinct Op in parsed_expr, including itself. """
+    subexprs = set()
+    to_visit = [parsed_expr]
+    while to_visit:
+        parsed_expr = to_visit.pop()
+        if type(parsed_expr) == Op and parsed_expr not in subexprs:
+            subexprs.add(parsed_expr)
+            to_visit += [parsed_expr.left, parsed_expr.right]
+    return subexprs
+
+
+def _can_raise(parsed_expr: str or Op, names: {Op: str}) -> bool:
+    """ Whether evaluating parsed_expr, minus subexpressions already in names, could raise (ex. sqrt(-1), 1/0). """
+    if type(parsed_expr) == str or parsed_expr in names:
+        return False
+    return parsed_expr.op in ('/', '^', 'pow', 'log') or \
+        _can_raise(parsed_expr.left, names) or _can_raise(parsed_expr.right, names)
+
+
+def _funcs_source(parsed_funcs: [str or Op]) -> str:
+    """
+    Source of a function of (x, y, z) returning the value of every parsed func,
+    where subexpressions shared by several funcs (ex. the root in both +/- funcs)
+    are computed once. A func that would raise a ValueError or ArithmeticError
+    (ex. dividing by 0, which derivatives often do at a surface's edge) is nan instead.
+    """
+    uses = collections.Counter()  # number of funcs each subexpression shows up in
+    for parsed_func in parsed_funcs:
+        uses.update(_subexprs(parsed_func))
+
+    names = {}
+    lines = ['def funcs(x, y, z):']
+
+    def assign(name: str, parsed_expr: str or Op, code: str) -> None:
+        if _can_raise(parsed_expr, names):
+            lines.extend(['    try:', f'        {name} = {code}',
+                          '    except (ValueError, ArithmeticError):', f'        {name} = nan'])
         else:
-            rest_of_expr = expr[char_idx + 1:]
-            return [plus_side + rest_of_expr, minus_side + rest_of_expr]
-    else:
-        return [expr]
+            lines.append(f'    {name} = {code}')
+
+    def render(parsed_expr: str or Op, parent_uses: int) -> str:
+        if type(parsed_expr) == str:
+            return _unparse(parsed_expr)
+        if parsed_expr in names:
+            return names[parsed_expr]
+
+        code = _unparse(Op(render(parsed_expr.left, uses[parsed_expr]), parsed_expr.op,
+                           render(parsed_expr.right, uses[parsed_expr])))
+        # only hoisted if it's shared by more funcs than the expression it's in, otherwise that gets hoisted
+        if uses[parsed_expr] > 1 and uses[parsed_expr] != parent_uses:
+            name = f'_shared{len(names)}'
+            assign(name, parsed_expr, code)
+            names[parsed_expr] = name
+            return name
+        return code
+
+    for i, parsed_func in enumerate(parsed_funcs):
+        assign(f'_func{i}', parsed_func, render(parsed_func, 0))
+    lines.append(f'    return {", ".join(f"_func{i}" for i in range(len(parsed_funcs)))},')
+    return '\n'.join(lines)
+
+
+def compile_funcs(parsed_funcs: [str or Op], math_module=math):
+    """
+    Compiles parsed funcs once into one function of (x, y, z) returning a tuple of all
+    their values (see _funcs_source). Pass ARRAY_MATH as math_module for arrays of x, y and z.
+    """
+    scope = {'math': math_module, 'nan': math.nan}
+    exec(_funcs_source(parsed_funcs), scope)
+    return scope['funcs']
 
 
 class Equation:
     def __init__(self, equation: str) -> None:
+        self.equation = equation
         self.var_out, self.vars_in = self.find_vars(equation)
-        self.funcs = solve_for(equation, self.var_out)  # list of strings
+        self.parsed_funcs = _solve_for(equation, self.var_out)
+        self.funcs = [_unparse(func) for func in self.parsed_funcs]  # list of strings
+        self.evaluate_funcs = compile_funcs(self.parsed_funcs)  # all funcs at once, nan where invalid
+        self.evaluate_array_funcs = compile_funcs(self.parsed_funcs, ARRAY_MATH)
+
+    # gradients are only worked out the first time they're used, since most Equations (bounds) never need them
+    @functools.cached_property
+    def parsed_gradients(self) -> [Op or str]:
+        """ Gradient (d/dx, d/dy, d/dz) of var_out - func for each func, all flattened into one list. """
+        return [differentiate(Op(self.var_out, '-', func), var) for func in self.parsed_funcs for var in VAR_IDX]
+
+    @functools.cached_property
+    def evaluate_gradients(self):
+        """ parsed_gradients compiled into one function of x, y and z. """
+        return compile_funcs(self.parsed_gradients)
+
+    @functools.cached_property
+    def evaluate_array_gradients(self):
+        """ Array version of evaluate_gradients. """
+        return compile_funcs(self.parsed_gradients, ARRAY_MATH)
+
+    @functools.cached_property
+    def parsed_implicit(self) -> Op or str:
+        """ lhs - rhs, which is 0 on every func's sheet at once. """
+        sides_of_equation = [_parse_expr(side) for side in self.equation.split('=')]
+        return simplify(Op(sides_of_equation[0], '-', sides_of_equation[1]))
+
+    @functools.cached_property
+    def evaluate_array_implicit(self):
+        """ parsed_implicit followed by its gradient, compiled into one array function of x, y and z. """
+        return compile_funcs([self.parsed_implicit] + [differentiate(self.parsed_implicit, var) for var in VAR_IDX],
+                             ARRAY_MATH)
 
     def find_vars(self, equation: str):
         """ Returns a variable in equation that I'd prefer to have equation in terms of. """
@@ -216,23 +577,77 @@ class Equation:
 
         return var_out, vars_in
 
+    def residuals(self, points) -> np.ndarray:
+        """
+        Evaluates var_out - func for every func at once over an N x 3 array of
+        (x, y, z) points, returning an N x len(funcs) array. Points outside a
+        func's domain (sqrt of a negative, log of a non-positive, etc.) are NaN.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+        residuals = np.empty((len(points), len(self.funcs)))
+
+        with np.errstate(all='ignore'):
+            for i, value in enumerate(self.evaluate_array_funcs(x, y, z)):
+                residuals[:, i] = points[:, VAR_IDX[self.var_out]] - value
+        residuals[~np.isfinite(residuals)] = np.nan
+        return residuals
+
+    def signs(self, points) -> np.ndarray:
+        """ Signs of residuals(points), staying NaN where a func is invalid. """
+        return np.sign(self.residuals(points))
+
+    def gradients(self, x, y, z) -> [(float, float, float)]:
+        """ Gradient of var_out - func at (x, y, z) for each func, with nan where a func is invalid. """
+        values = self.evaluate_gradients(x, y, z)
+        return [values[i: i + 3] for i in range(0, len(values), 3)]
+
+    def gradients_array(self, points) -> np.ndarray:
+        """ Array version of gradients for an N x 3 array of points, returning an N x len(funcs) x 3 array. """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        gradients = np.empty((len(points), len(self.funcs) * 3))
+
+        with np.errstate(all='ignore'):
+            for i, value in enumerate(self.evaluate_array_gradients(points[:, 0], points[:, 1], points[:, 2])):
+                gradients[:, i] = value
+        gradients[~np.isfinite(gradients)] = np.nan
+        return gradients.reshape(len(points), len(self.funcs), 3)
+
+    def implicit(self, points) -> (np.ndarray, np.ndarray):
+        """
+        Evaluates lhs - rhs over an N x 3 array of points, returning it as an N array along with its N x 3
+        gradient. Unlike residuals, its sign changes across every func's sheet. NaN where invalid.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        values = np.empty((len(points), 4))
+
+        with np.errstate(all='ignore'):
+            for i, value in enumerate(self.evaluate_array_implicit(points[:, 0], points[:, 1], points[:, 2])):
+                values[:, i] = value
+        values[~np.isfinite(values)] = np.nan
+        return values[:, 0], values[:, 1:]
+
+    def residual_intervals(self, box: {str: (float, float)}) -> [Interval or None]:
+        """ Guaranteed range of var_out - func over box, (low, high) for each of x, y and z, for each func. """
+        return [interval(Op(self.var_out, '-', func), box) for func in self.parsed_funcs]
+
     def xy_intercept(self, z_in: str, var_out: str):
         """ Less-than-3D equation of self.equ where z variable, if present, is set to z param. """
-        new_equ = solve_for(self.funcs.replace('z', f'({z_in})'), var_out)
+        new_equ = solve_for(self.equation.replace('z', f'({z_in})'), var_out)
         if new_equ is not None:
             return new_equ
         raise EquationError()
 
     def xz_intercept(self, y_in: str, var_out: str):
         """ Less-than-3D equation of self.equ where y variable, if present, is set to z param. """
-        new_equ = solve_for(self.funcs.replace('y', f'({y_in})'), var_out)
+        new_equ = solve_for(self.equation.replace('y', f'({y_in})'), var_out)
         if new_equ is not None:
             return new_equ
         raise EquationError()
 
     def yz_intercept(self, x_in: str, var_out: str):
         """ Less-than-3D equation of self.equ where z variable, if present, is set to z param. """
-        new_equ = solve_for(self.funcs.replace('x', f'({x_in})'), var_out)
+        new_equ = solve_for(self.equation.replace('x', f'({x_in})'), var_out)
         if new_equ is not None:
             return new_equ
         raise EquationError()
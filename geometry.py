@@ -1,5 +1,8 @@
 import math
 import collections
+import functools
+import os
+import numpy as np
 import matrices
 
 
@@ -15,22 +18,69 @@ class ZeroVectorError(Exception):
     pass
 
 
+ROTATION_CACHE_SIZE = 256
+RENORMALIZE_STEPS = 16
+MAX_FACE_CORNERS = 4  # width of a Mesh's index rows
+# offsets to a VertexWelder cell's neighbors, its own first as that's where a match is likeliest
+NEIGHBOR_OFFSETS = sorted(((i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)),
+                          key=lambda offset: offset != (0, 0, 0))
+MESH_ARRAYS = ('vertices', 'faces', 'corner_counts', 'vertex_normals', 'closed')  # what Mesh.save writes, one .npy each
+
 Point2 = collections.namedtuple('Point2', ['x', 'y'])
 Point3 = collections.namedtuple('Point3', ['x', 'y', 'z'])
 
 
-def duplicate_points(points: [Point3]) -> bool:
-    if len(points) > 1:
-        for point in points[1:]:
-            if points[0] == point:
-                return True
-        else:
-            return duplicate_points(points[1:])
-    else:
-        return False
-
-
+def duplicate_points(points: [Point3], tolerance: float = 0) -> bool:
+    """ Whether any two points are within tolerance of each other (by default, equal), in expected linear time. """
+    welder = VertexWelder(tolerance)
+    return any(welder.add(point) != i for i, point in enumerate(points))
+
+
+class VertexWelder:
+    """
+    Merges points that are within tolerance of each other into shared vertices, in expected linear time.
+    Points are hashed into cells of the tolerance's size, so a point only gets compared with the vertices
+    in its own cell and the ones around it.
+    """
+    def __init__(self, tolerance: float = 0) -> None:
+        self.tolerance = tolerance
+        self.vertices = []
+        self._cells = {}  # cell: indices of the vertices in it
+
+    def _cell(self, point: Point3) -> (float, float, float):
+        if self.tolerance == 0:
+            return point.x, point.y, point.z
+        return (math.floor(point.x / self.tolerance), math.floor(point.y / self.tolerance),
+                math.floor(point.z / self.tolerance))
+
+    def add(self, point: Point3) -> int:
+        """ Index of the vertex within tolerance of point, which becomes a new vertex if there isn't one. """
+        cell = self._cell(point)
+        for i, j, k in NEIGHBOR_OFFSETS if self.tolerance else NEIGHBOR_OFFSETS[:1]:
+            for index in self._cells.get((cell[0] + i, cell[1] + j, cell[2] + k), ()):
+                vertex = self.vertices[index]
+                distance_squared = (vertex.x - point.x) ** 2 + (vertex.y - point.y) ** 2 + (vertex.z - point.z) ** 2
+                if distance_squared <= self.tolerance ** 2:
+                    return index
+
+        self.vertices += [point]
+        self._cells.setdefault(cell, []).append(len(self.vertices) - 1)
+        return len(self.vertices) - 1
+
+
+def weld_points(points: [Point3], tolerance: float = 0) -> ([Point3], [int]):
+    """ Points merged into shared vertices (see VertexWelder), and the index of each point's vertex. """
+    welder = VertexWelder(tolerance)
+    indices = [welder.add(point) for point in points]
+    return welder.vertices, indices
+
+
+@functools.lru_cache(maxsize=ROTATION_CACHE_SIZE)
 def rotate_matrix(theta_xy, theta_yz, theta_xz):
+    """
+    Rotation in the xy, then yz, then xz plane (applied to a vector right to left). The same few angle
+    triples come up over and over, so matrices are cached by them, which means they're shared: read-only.
+    """
     xy_rotate = matrices.Matrix([[math.cos(theta_xy), -math.sin(theta_xy), 0],
                                  [math.sin(theta_xy), math.cos(theta_xy),  0],
                                  [0,                  0,                   1]])
@@ -43,15 +93,98 @@ def rotate_matrix(theta_xy, theta_yz, theta_xz):
                                  [0,                  1, 0],
                                  [math.sin(theta_xz), 0, math.cos(theta_xz)]])
 
-    return xy_rotate.matrix_multiplication(yz_rotate).matrix_multiplication(xz_rotate)
+    rotate = xy_rotate.matrix_multiplication(yz_rotate).matrix_multiplication(xz_rotate)
+    rotate.matrix.flags.writeable = False
+    return rotate
+
+
+class Quaternion:
+    """ Unit quaternion w + xi + yj + zk standing for a 3D rotation, which composes without drifting off one. """
+    __slots__ = ('w', 'x', 'y', 'z')
+
+    def __init__(self, w, x, y, z) -> None:
+        self.w = w
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @classmethod
+    def from_axis_angle(cls, axis: 'Vector', angle: float) -> 'Quaternion':
+        """ Rotation by angle (counterclockwise looking down axis) about axis """
+        axis = axis.unit_vector()
+        sin_half = math.sin(angle / 2)
+        return cls(math.cos(angle / 2), axis.x * sin_half, axis.y * sin_half, axis.z * sin_half)
+
+    @classmethod
+    def from_rotation(cls, theta_xy, theta_yz, theta_xz) -> 'Quaternion':
+        """ Same rotation as rotate_matrix(theta_xy, theta_yz, theta_xz) """
+        return _rotation_quaternion(theta_xy, theta_yz, theta_xz)
+
+    def times(self, q: 'Quaternion') -> 'Quaternion':
+        """ Hamilton product, the rotation q followed by this one """
+        return Quaternion(self.w * q.w - self.x * q.x - self.y * q.y - self.z * q.z,
+                          self.w * q.x + self.x * q.w + self.y * q.z - self.z * q.y,
+                          self.w * q.y - self.x * q.z + self.y * q.w + self.z * q.x,
+                          self.w * q.z + self.x * q.y - self.y * q.x + self.z * q.w)
+
+    def normalized(self) -> 'Quaternion':
+        """ Scaled back to a magnitude of 1, undoing rounding that builds up over many products """
+        magnitude = math.sqrt(self.w * self.w + self.x * self.x + self.y * self.y + self.z * self.z)
+        if magnitude == 0:
+            raise ZeroVectorError()
+        return Quaternion(self.w / magnitude, self.x / magnitude, self.y / magnitude, self.z / magnitude)
+
+    def to_matrix(self) -> matrices.Matrix:
+        """ 3x3 rotation matrix of a unit quaternion """
+        w, x, y, z = self.w, self.x, self.y, self.z
+        return matrices.Matrix([[1 - 2 * (y * y + z * z), 2 * (x * y - w * z),     2 * (x * z + w * y)],
+                                [2 * (x * y + w * z),     1 - 2 * (x * x + z * z), 2 * (y * z - w * x)],
+                                [2 * (x * z - w * y),     2 * (y * z + w * x),     1 - 2 * (x * x + y * y)]])
+
+
+@functools.lru_cache(maxsize=ROTATION_CACHE_SIZE)
+def _rotation_quaternion(theta_xy, theta_yz, theta_xz) -> Quaternion:
+    # xy plane is about z, while yz and xz in rotate_matrix turn the opposite way about x and y
+    xy_rotate = Quaternion(math.cos(theta_xy / 2), 0, 0, math.sin(theta_xy / 2))
+    yz_rotate = Quaternion(math.cos(theta_yz / 2), -math.sin(theta_yz / 2), 0, 0)
+    xz_rotate = Quaternion(math.cos(theta_xz / 2), 0, -math.sin(theta_xz / 2), 0)
+    return xy_rotate.times(yz_rotate).times(xz_rotate)
+
+
+class Rotation:
+    """
+    Running total of rotations, kept as a unit quaternion that's renormalized every RENORMALIZE_STEPS
+    rotations. Its matrix is only rebuilt when asked for after a change, so several rotations in a row
+    cost a quaternion product each.
+    """
+    def __init__(self) -> None:
+        self.quaternion = Quaternion(1, 0, 0, 0)
+        self._steps = 0
+        self._matrix = None
+
+    def rotate(self, theta_xy, theta_yz, theta_xz) -> None:
+        """ Adds a rotation (same angles as rotate_matrix) after the ones so far """
+        self.quaternion = Quaternion.from_rotation(theta_xy, theta_yz, theta_xz).times(self.quaternion)
+        self._steps += 1
+        if self._steps % RENORMALIZE_STEPS == 0:
+            self.quaternion = self.quaternion.normalized()
+        self._matrix = None
+
+    @property
+    def matrix(self) -> matrices.Matrix:
+        if self._matrix is None:
+            self._matrix = self.quaternion.to_matrix()
+        return self._matrix
 
 
 class Vector:
+    __slots__ = ('x', 'y', 'z', '_magnitude')  # no per-instance __dict__, treat x, y and z as read-only
+
     def __init__(self, x, y, z) -> None:
         self.x = x
         self.y = y
         self.z = z
-        self.magnitude = self.magnitude()
+        self._magnitude = None
 
     def plus(self, v: 'Vector') -> 'Vector':
         """ Adds two vectors """
@@ -75,9 +208,12 @@ class Vector:
                       v.x * self.z - self.x * v.z,
                       self.x * v.y - v.x * self.y)
 
+    @property
     def magnitude(self) -> float:
-        """ Magnitude of a vector """
-        return math.sqrt(self.dot_product(self))
+        """ Magnitude of a vector, worked out the first time it's needed and kept after that """
+        if self._magnitude is None:
+            self._magnitude = math.sqrt(self.dot_product(self))
+        return self._magnitude
 
     def unit_vector(self) -> 'Vector':
         """ Returns vector of same direction but magnitude of 1 """
@@ -95,6 +231,90 @@ class Vector:
         return v.times(self.dot_product(v) / v.dot_product(v))
 
 
+def _as_array(v: 'Vector or VectorArray') -> np.ndarray:
+    """ A Vector as a 3 long array (which broadcasts against N x 3), or a VectorArray's N x 3 array. """
+    if type(v) == Vector:
+        return np.array([v.x, v.y, v.z])
+    return v.array
+
+
+class VectorArray:
+    """ N vectors held as one N x 3 float array, so each operation runs on all of them at once. """
+    def __init__(self, array) -> None:
+        self.array = np.asarray(array, dtype=float).reshape(-1, 3)
+
+    @classmethod
+    def from_vectors(cls, vectors: [Vector]) -> 'VectorArray':
+        return cls([(v.x, v.y, v.z) for v in vectors])
+
+    def to_vectors(self) -> [Vector]:
+        return [Vector(*row) for row in self.array.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, i: int) -> Vector:
+        return Vector(*self.array[i].tolist())
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.array[:, 0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.array[:, 1]
+
+    @property
+    def z(self) -> np.ndarray:
+        return self.array[:, 2]
+
+    def plus(self, v: 'Vector or VectorArray') -> 'VectorArray':
+        """ Adds v (one Vector to all of them, or row by row) """
+        return VectorArray(self.array + _as_array(v))
+
+    def minus(self, v: 'Vector or VectorArray') -> 'VectorArray':
+        """ Subtracts v (one Vector from all of them, or row by row) """
+        return VectorArray(self.array - _as_array(v))
+
+    def times(self, scalar: float or np.ndarray) -> 'VectorArray':
+        """ Multiplies by a scalar, or by N scalars row by row """
+        return VectorArray(self.array * np.reshape(scalar, (-1, 1)))
+
+    def dot_product(self, v: 'Vector or VectorArray') -> np.ndarray:
+        """ N dot products """
+        return np.einsum('ij,ij->i', self.array, np.broadcast_to(_as_array(v), self.array.shape))
+
+    def cross_product(self, v: 'Vector or VectorArray') -> 'VectorArray':
+        """ N cross products """
+        return VectorArray(np.cross(self.array, _as_array(v)))
+
+    @property
+    def magnitude(self) -> np.ndarray:
+        """ N magnitudes """
+        return np.sqrt(self.dot_product(self))
+
+    def unit_vector(self) -> 'VectorArray':
+        """ Same directions but magnitudes of 1 """
+        magnitude = self.magnitude
+        if np.any(magnitude == 0):
+            raise ZeroVectorError()
+        return self.times(1 / magnitude)
+
+    def angle_between_vectors(self, v: 'Vector or VectorArray') -> np.ndarray:
+        """ N angles, clipped so rounding can't push a cos past +/-1 """
+        v_magnitude = VectorArray(np.broadcast_to(_as_array(v), self.array.shape)).magnitude
+        return np.arccos(np.clip(self.dot_product(v) / self.magnitude / v_magnitude, -1, 1))
+
+    def projected_onto(self, v: 'Vector or VectorArray') -> 'VectorArray':
+        v = VectorArray(np.broadcast_to(_as_array(v), self.array.shape))
+        return v.times(self.dot_product(v) / v.dot_product(v))
+
+
+def face_normals(first: VectorArray, second: VectorArray, third: VectorArray) -> VectorArray:
+    """ Normals of N faces from their first three corners, the same way as Plane, all at once. """
+    return first.minus(second).cross_product(third.minus(second)).unit_vector()
+
+
 class Plane:
     def __init__(self, points: [Vector]) -> None:
         if len(points) != 3 or duplicate_points(points):
@@ -133,11 +353,13 @@ class Line:
 
 
 class Face:
-    def __init__(self, corners: [Vector]) -> None:
+    def __init__(self, corners: [Vector], vertex_normals: [Vector or None] = None,
+                 normal_vector: Vector = None) -> None:  # normal_vector if already worked out, ex. by face_normals
         if len(corners) < 3 or duplicate_points(corners):
             raise PlanePointsError('Must have at least 3 distinct corners in a face.')
         self.corners = corners
-        self.normal_vector = self.new_normal_vector()
+        self.normal_vector = normal_vector if normal_vector is not None else self.new_normal_vector()
+        self.vertex_normals = self.new_vertex_normals(vertex_normals)  # for smooth shading, None if not given
 
     def new_normal_vector(self):
         p1 = self.corners[0]
@@ -145,3 +367,150 @@ class Face:
         p3 = self.corners[2]
 
         return Plane([p1, p2, p3]).normal_vector
+
+    def new_vertex_normals(self, vertex_normals: [Vector or None] or None) -> [Vector] or None:
+        """ Per corner normals flipped to the same side as the face's, with the face's normal standing in for None. """
+        if vertex_normals is None:
+            return None
+
+        normals = []
+        for normal in vertex_normals:
+            if normal is None:
+                normals += [self.normal_vector]
+            elif normal.dot_product(self.normal_vector) < 0:
+                normals += [normal.times(-1)]
+            else:
+                normals += [normal]
+        return normals
+
+
+class Mesh:
+    """
+    Faces as rows of indices into one shared N x 3 vertex array, so a corner shared by several faces is stored
+    (and transformed) once. A face with fewer than MAX_FACE_CORNERS corners repeats its last index to fill its
+    row. Vertex normals are NaN where there isn't one, and face normals and centroids are cached once worked out.
+    A closed mesh has every face's normal pointing out, so only the faces whose normals point at a viewer show.
+    """
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray, corner_counts: np.ndarray,
+                 vertex_normals: np.ndarray = None, closed: bool = False, normals: np.ndarray = None,
+                 centroids: np.ndarray = None) -> None:
+        self.vertices = vertices
+        self.faces = faces
+        self.corner_counts = corner_counts
+        self.vertex_normals = vertex_normals if vertex_normals is not None else np.full_like(vertices, np.nan)
+        self.closed = bool(closed)
+        self._normals = normals
+        self._centroids = centroids
+        self.grown_from = None  # the mesh this one extends, until it's extended itself (see extended)
+
+    @classmethod
+    def from_faces(cls, vertices: [Vector], face_indices: [[int]], vertex_normals: [Vector or None] = None,
+                   closed: bool = False) -> 'Mesh':
+        """ A mesh of vertices, with each face given as the indices of its corners. """
+        vertex_array = np.array([(vertex.x, vertex.y, vertex.z) for vertex in vertices], dtype=float).reshape(-1, 3)
+        faces = np.array([indices + indices[-1:] * (MAX_FACE_CORNERS - len(indices)) for indices in face_indices],
+                         dtype=np.intp).reshape(-1, MAX_FACE_CORNERS)
+        corner_counts = np.array([len(indices) for indices in face_indices], dtype=np.intp)
+
+        normal_array = None
+        if vertex_normals is not None:
+            normal_array = np.array([(np.nan,) * 3 if normal is None else (normal.x, normal.y, normal.z)
+                                     for normal in vertex_normals], dtype=float).reshape(-1, 3)
+        return cls(vertex_array, faces, corner_counts, normal_array, closed)
+
+    @classmethod
+    def load(cls, path: str) -> 'Mesh' or None:
+        """
+        A mesh written by save to path, with its arrays memory mapped (read only) rather than read in,
+        or None if it isn't all there.
+        """
+        try:
+            return cls(*[np.load(f'{path}-{name}.npy', mmap_mode='r') for name in MESH_ARRAYS])
+        except (OSError, ValueError):
+            return None
+
+    def save(self, path: str) -> None:
+        """ Writes each of the mesh's arrays to its own .npy file starting with path. """
+        for name in MESH_ARRAYS:
+            # written under a temporary name first, so a half written file never gets loaded
+            temporary = f'{path}-{name}.{os.getpid()}.npy'
+            np.save(temporary, np.asarray(getattr(self, name)))
+            os.replace(temporary, f'{path}-{name}.npy')
+
+    def __len__(self) -> int:
+        return len(self.faces)
+
+    @property
+    def normals(self) -> np.ndarray:
+        """ F x 3 unit normals of the faces, from their first three corners the same way as Plane. """
+        if self._normals is None:
+            self._normals = face_normals(*[VectorArray(self.vertices[self.faces[:, i]]) for i in range(3)]).array
+        return self._normals
+
+    @property
+    def centroids(self) -> np.ndarray:
+        """ F x 3 averages of the faces' corners. """
+        if self._centroids is None:
+            counted = np.arange(MAX_FACE_CORNERS) < self.corner_counts[:, None]  # leaves out repeated indices
+            corners = self.vertices[self.faces] * counted[:, :, None]
+            self._centroids = corners.sum(axis=1) / self.corner_counts[:, None]
+        return self._centroids
+
+    def winds_closed(self) -> bool:
+        """ Whether every edge is gone along once each way, so the mesh is closed and wound the same way throughout. """
+        ends = np.roll(self.faces, -1, axis=1)
+        edge = self.faces != ends  # leaves out the "edges" between repeated indices
+        forward = self.faces[edge].astype(np.int64) * len(self.vertices) + ends[edge]
+        backward = ends[edge].astype(np.int64) * len(self.vertices) + self.faces[edge]
+        return len(forward) > 0 and len(np.unique(forward)) == len(forward) and np.isin(backward, forward).all()
+
+    def volume(self) -> float:
+        """ Volume a closed mesh encloses, negative if its normals point in. """
+        vertices = self.vertices[self.faces]
+        areas = np.linalg.norm(np.cross(vertices[:, 2] - vertices[:, 0], vertices[:, 3] - vertices[:, 1]), axis=1) / 2
+        return np.einsum('ij,ij,i->', self.centroids, self.normals, areas) / 3
+
+    def extended(self, more: 'Mesh') -> 'Mesh':
+        """
+        The mesh with more's vertices after its own and more's faces after its own, where more's faces index
+        into the vertices of both. Normals and centroids already worked out are kept, so only more's are added.
+        It's closed if more is, as whatever's added last is what closes a mesh up, if anything does.
+        """
+        vertices = np.concatenate([self.vertices, more.vertices])
+        added = Mesh(vertices, more.faces, more.corner_counts, normals=more._normals, centroids=more._centroids)
+        mesh = Mesh(vertices, np.concatenate([self.faces, more.faces]),
+                    np.concatenate([self.corner_counts, more.corner_counts]),
+                    np.concatenate([self.vertex_normals, more.vertex_normals]), more.closed,
+                    None if self._normals is None else np.concatenate([self._normals, added.normals]),
+                    None if self._centroids is None else np.concatenate([self._centroids, added.centroids]))
+        mesh.grown_from = self
+        self.grown_from = None  # so a mesh grown many times over only holds on to the one before it
+        return mesh
+
+    def corners(self, face: int) -> np.ndarray:
+        """ Indices of a face's corners. """
+        return self.faces[face, :self.corner_counts[face]]
+
+    def transformed(self, rotate: matrices.Matrix) -> 'Mesh':
+        """ A mesh with the same faces, with its vertices and normals turned by the rotation matrix rotate. """
+        normals = None if self._normals is None else rotate.times_points(self._normals)
+        centroids = None if self._centroids is None else rotate.times_points(self._centroids)
+        return Mesh(rotate.times_points(self.vertices), self.faces, self.corner_counts,
+                    rotate.times_points(self.vertex_normals), self.closed, normals, centroids)
+
+    def reorder(self, order: [int]) -> None:
+        """ Puts the faces in order, where order lists the face indices in their new order. """
+        self.faces = self.faces[order]
+        self.corner_counts = self.corner_counts[order]
+        if self._normals is not None:
+            self._normals = self._normals[order]
+        if self._centroids is not None:
+            self._centroids = self._centroids[order]
+
+    def to_faces(self) -> [Face]:
+        """ The mesh as separate Faces, each with its own corners. """
+        vertices = VectorArray(self.vertices).to_vectors()
+        vertex_normals = [None if np.isnan(normal[0]) else Vector(*normal) for normal in self.vertex_normals.tolist()]
+        normals = VectorArray(self.normals).to_vectors()
+        return [Face([vertices[i] for i in self.corners(face)], [vertex_normals[i] for i in self.corners(face)],
+                     normals[face]) for face in range(len(self))]
@@ -1,8 +1,12 @@
+import numpy as np
+
 INVALID_MATRIX_MESSAGE = 'Matrix is empty, doesn\'t have same number of entries in ' \
                          'each column, and/or has at least 1 non-number entry.'
 INVALID_MATRIX_MULT_MESSAGE = 'left_matrix number of columns != right_matrix number of rows'
 NOT_SCALAR_MESSAGE = 'scalar is not a real number'
 NOT_SAME_SIZE_MESSAGE = 'matrices are different sizes'
+NOT_VECTOR_SIZE_MESSAGE = 'vector doesn\'t have one entry for each matrix column'
+NUMBER_TYPES = (int, float, np.integer, np.floating)
 
 
 class InvalidMatrixError(Exception):
@@ -13,31 +17,63 @@ class InvalidCalcError(Exception):
     pass
 
 
+def mat3_times_vec3(rows: ((float,),), x, y, z) -> (float, float, float):
+    """ 3x3 matrix (as rows) times the column vector (x, y, z), unrolled so no arrays get made. """
+    (a, b, c), (d, e, f), (g, h, i) = rows
+    return a * x + b * y + c * z, d * x + e * y + f * z, g * x + h * y + i * z
+
+
+def mat4_times_vec4(rows: ((float,),), x, y, z, w) -> (float, float, float, float):
+    """ 4x4 matrix (as rows) times the column vector (x, y, z, w), unrolled so no arrays get made. """
+    (a, b, c, d), (e, f, g, h), (i, j, k, l), (m, n, o, p) = rows
+    return a * x + b * y + c * z + d * w, e * x + f * y + g * z + h * w, \
+        i * x + j * y + k * z + l * w, m * x + n * y + o * z + p * w
+
+
+VECTOR_KERNELS = {3: mat3_times_vec3, 4: mat4_times_vec4}
+
+
 class Matrix:
-    def __init__(self, matrix: [[int or float]]) -> None:
+    def __init__(self, matrix: [[int or float]] or np.ndarray) -> None:
         if self.valid_matrix(matrix):
-            self.matrix = matrix
-            self.rows = len(matrix)
-            self.cols = len(matrix[0])
+            self.matrix = np.array(matrix, dtype=float)
+            self.rows, self.cols = self.matrix.shape
+            self._row_tuples = None  # filled in the first time a fixed size kernel needs it
         else:
             raise InvalidMatrixError(INVALID_MATRIX_MESSAGE)
 
+    @classmethod
+    def _trusted(cls, matrix: np.ndarray) -> 'Matrix':
+        """
+        Wraps a 2D float array that's valid by construction, like the result of an operation on
+        Matrices, without copying it or running valid_matrix over it again.
+        """
+        trusted = cls.__new__(cls)
+        trusted.matrix = matrix
+        trusted.rows, trusted.cols = matrix.shape
+        trusted._row_tuples = None
+        return trusted
+
     def valid_matrix(self, matrix) -> bool:
         """
-        Returns True if matrix is non empty, organized in 2D list,
-        has same number of entries in each column, and if all
+        Returns True if matrix is non empty, organized in 2D list (or
+        2D array), has same number of entries in each column, and if all
         entries are actually numbers, but False otherwise.
         """
+        if type(matrix) == np.ndarray:
+            return matrix.ndim == 2 and matrix.size > 0 and \
+                (np.issubdtype(matrix.dtype, np.integer) or np.issubdtype(matrix.dtype, np.floating))
+
         if type(matrix) != list or len(matrix) == 0 or \
                 type(matrix[0]) != list or len(matrix[0]) == 0:  # empty or not 2D list
             return False
 
         col_num = len(matrix[0])
         for row in matrix:
-            if type(row) != list and col_num != len(row):  # not 2D list or not same number of entries in each column
+            if type(row) != list or col_num != len(row):  # not 2D list or not same number of entries in each column
                 return False
             for col in row:
-                if type(col) not in [int, float]:  # not all entries are numbers
+                if not isinstance(col, NUMBER_TYPES) or type(col) == bool:  # not all entries are numbers
                     return False
         return True
 
@@ -51,46 +87,53 @@ class Matrix:
 
     def is_scalar(self, scalar: int or float) -> bool:
         """ Return True if scalar is a real number, False otherwise. """
-        return type(scalar) in [int, float]
+        return isinstance(scalar, NUMBER_TYPES) and type(scalar) != bool
 
     def addition(self, matrix: 'Matrix') -> 'Matrix':
         """ Returns a new matrix derived from adding left_matrix to right_matrix, provided they're compatible. """
         if self.same_size_matrices(matrix):
-            new_matrix = []
-            for i in range(self.rows):
-                row = []
-                for j in range(self.cols):
-                    row += [self.matrix[i][j] + self.matrix[i][j]]
-                new_matrix += [row]
-            return Matrix(new_matrix)
+            return Matrix._trusted(self.matrix + matrix.matrix)
         else:
             raise InvalidCalcError(NOT_SAME_SIZE_MESSAGE)
 
     def scalar_multiplication(self, scalar: int or float) -> 'Matrix':
         """ Returns a new matrix derived from multiplying matrix by a scalar, provided scalar is a real number. """
         if self.is_scalar(scalar):
-            new_matrix = []
-            for i in range(self.rows):
-                row = []
-                for j in range(self.cols):
-                    row += [self.matrix[i][j] * scalar]
-                new_matrix += [row]
-            return Matrix(new_matrix)
+            return Matrix._trusted(self.matrix * float(scalar))
         else:
             raise InvalidCalcError(NOT_SCALAR_MESSAGE)
 
     def matrix_multiplication(self, matrix: 'Matrix') -> 'Matrix':
         """ Returns a new matrix derived from multiplying left_matrix and right_matrix, provided they're compatible. """
-        if self.valid_matrix_multiplication:
-            new_matrix = []
-            for i in range(self.rows):
-                row = []
-                for j in range(matrix.cols):
-                    element_sum = 0
-                    for k in range(self.cols):
-                        element_sum += self.matrix[i][k] * matrix.matrix[k][j]
-                    row += [element_sum]
-                new_matrix += [row]
-            return Matrix(new_matrix)
+        if self.valid_matrix_multiplication(matrix):
+            return Matrix._trusted(self.matrix @ matrix.matrix)
         else:
             raise InvalidCalcError(INVALID_MATRIX_MULT_MESSAGE)
+
+    def times_vector(self, *vector: int or float) -> (float,):
+        """
+        Returns matrix times the column vector given as separate entries, as a tuple. Square 3x3 and 4x4
+        matrices (rotations, transforms) use unrolled kernels, so nothing is allocated besides the tuple.
+        """
+        if len(vector) != self.cols:
+            raise InvalidCalcError(NOT_VECTOR_SIZE_MESSAGE)
+
+        if self.rows == self.cols and self.rows in VECTOR_KERNELS:
+            if self._row_tuples is None:
+                self._row_tuples = tuple(tuple(row) for row in self.matrix.tolist())
+            return VECTOR_KERNELS[self.rows](self._row_tuples, *vector)
+        return tuple((self.matrix @ np.array(vector, dtype=float)).tolist())
+
+    def times_points(self, points: np.ndarray, out: np.ndarray = None, columns: bool = False) -> np.ndarray:
+        """
+        Returns matrix times every point in an N x cols block of row points (or, if columns, a cols x N
+        block of column points) from one call, in the same layout. Pass out (which can be points itself)
+        to write into a preallocated buffer instead of allocating the result.
+        """
+        points = np.asarray(points, dtype=float)
+        if points.ndim != 2 or (points.shape[0] if columns else points.shape[1]) != self.cols:
+            raise InvalidCalcError(NOT_VECTOR_SIZE_MESSAGE)
+
+        if columns:
+            return np.matmul(self.matrix, points, out=out)
+        return np.matmul(points, self.matrix.T, out=out)
@@ -3,7 +3,11 @@ import collections
 import math
 import matrices
 import algebra
-import copy
+import hashlib
+import itertools
+import multiprocessing
+import os
+import numpy as np
 
 Part = collections.namedtuple('Part', ['equ', 'bound'])
 Boundary = collections.namedtuple('Boundary', ['eqns'])  # list of equations, function can't pass
@@ -11,6 +15,18 @@ SetOfPlanes = collections.namedtuple('SetOfPlanes', ['x', 'y'])
 PointsOfEquation = collections.namedtuple('PointsOfEquation', ['expr', 'planes'])
 
 MAGNITUDE_STEP = 10
+RAY_CHUNK = 64  # steps along a ray classified per batch
+TOLERANCE = 1e-4  # how far along a ray a vertex can be from where func signs change
+MAX_REFINE_STEPS = 64
+OCTREE_DEPTH = 4  # most times surface_cells splits the boundary box in 8
+OCTREE_CELLS = 32  # fewest grid cells across one of its cells, any fewer and ruling them out costs more than it saves
+PRUNE_FRACTION = 0.5  # most of the grid the surface's cells can cover before it's quicker to sample all of it
+DIRECTION_TOLERANCE = 1e-9  # how close two ray directions can be and still be cast as one ray
+MESHERS = ('rays', 'grid')  # casting rays out from the origin, or dual contouring over a grid of the boundary box
+CELL_INSET = 1e-6  # fraction of a grid cell its vertex is kept away from the cell's sides
+BAND_CELLS = 64  # cells cast per worker between yields of a progressive build, about a frame's worth
+CHUNKS_PER_WORKER = 4  # rays are split into this many chunks per worker process, to even out the load
+MESH_CACHE_VERSION = 4  # part of every cached mesh's key, bump it whenever meshing changes to ignore old ones
 REVOLUTION = 2 * math.pi
 ZERO_VECTOR = geometry.Vector(0, 0, 0)
 
@@ -31,13 +47,13 @@ def vector_to_matrix(vector):
 
 def matrix_to_vector(matrix: matrices.Matrix):
     if matrix.rows == 3 and matrix.cols == 1:
-        return geometry.Vector(matrix.matrix[0][0], matrix.matrix[1][0], matrix.matrix[2][0])
+        return geometry.Vector(*matrix.matrix[:, 0].tolist())
     else:
         raise NotAVectorError()
 
 
 def _matrix_times_a_vector(matrix, vector):
-    return matrix_to_vector(matrix.matrix_multiplication(vector_to_matrix(vector)))
+    return geometry.Vector(*matrix.times_vector(vector.x, vector.y, vector.z))
 
 
 def sign(num: int or float) -> int:
@@ -47,25 +63,356 @@ def sign(num: int or float) -> int:
         return int(num/abs(num))
 
 
+def _first_change(signs: np.ndarray, orig_signs: np.ndarray) -> int or None:
+    """ Index of the first row of signs that differs from orig_signs (NaN matches NaN), or None. """
+    changed = (signs != orig_signs) & ~(np.isnan(signs) & np.isnan(orig_signs))
+    rows = np.flatnonzero(changed.any(axis=1))
+    return rows[0] if len(rows) > 0 else None
+
+
+def _along(direction: (float, float, float), magnitude: float) -> (float, float, float):
+    return direction[0] * magnitude, direction[1] * magnitude, direction[2] * magnitude
+
+
+def _func_residuals(equ: algebra.Equation, point: (float, float, float)) -> [float]:
+    """ var_out - func for each of equ's funcs at point, nan where a func is invalid. """
+    var_out = point[algebra.VAR_IDX[equ.var_out]]
+    return [var_out - value for value in equ.evaluate_funcs(*point)]
+
+
+def _same_signs(residuals: [float], orig_signs: np.ndarray) -> bool:
+    """ Whether residuals have orig_signs, where nan matches nan. """
+    for residual, orig_sign in zip(residuals, orig_signs):
+        if math.isnan(residual) or math.isnan(orig_sign):
+            if math.isnan(residual) != math.isnan(orig_sign):
+                return False
+        elif sign(residual) != orig_sign:
+            return False
+    return True
+
+
+def _newton_step(equ: algebra.Equation, i: int, direction: (float, float, float),
+                 magnitude: float, residual: float) -> float or None:
+    """ Where a Newton step on func i's residual along direction goes from magnitude, or None if it can't step. """
+    gradient = equ.gradients(*_along(direction, magnitude))[i]
+    slope = gradient[0] * direction[0] + gradient[1] * direction[1] + gradient[2] * direction[2]
+    if not math.isfinite(residual) or not math.isfinite(slope) or slope == 0:
+        return None
+    return magnitude - residual / slope
+
+
+class MesherError(Exception):
+    pass
+
+
 class BoundaryError(Exception):
     pass
 
 
+def boundary_box(boundary: Boundary) -> {str: (float, float)}:
+    """ Range of each of x, y and z enclosed by boundary's constant equations (ex. x=-600 and x=600). """
+    values = {var: [] for var in algebra.VAR_IDX}
+    for equ in boundary.eqns:
+        if not equ.vars_in:
+            values[equ.var_out] += list(equ.evaluate_funcs(0, 0, 0))
+
+    if any(len(var_values) < 2 for var_values in values.values()):
+        raise BoundaryError('Need two constant equations (ex. x=-600 and x=600) for each of x, y and z.')
+    return {var: (min(var_values), max(var_values)) for var, var_values in values.items()}
+
+
+def _may_have_surface(equ: algebra.Equation, box: {str: (float, float)}) -> bool:
+    """ False only if none of equ's funcs can change sign (or become valid or invalid) inside box. """
+    for residuals in equ.residual_intervals(box):
+        if residuals is not None and (residuals.partial or residuals.low <= 0 <= residuals.high):
+            return True
+    return False
+
+
+def _mesh_key(parts: [Part], divisor: int, tolerance: float, mesher: str) -> str:
+    """ Hash of everything that goes into making a mesh, which a cached copy of it is saved under. """
+    settings = (MESH_CACHE_VERSION, mesher, divisor, tolerance,
+                MAGNITUDE_STEP, RAY_CHUNK, MAX_REFINE_STEPS, DIRECTION_TOLERANCE, CELL_INSET,
+                [(part.equ.equation, [equ.equation for equ in part.bound.eqns]) for part in parts])
+    return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+
+def _dual_contour(equ: algebra.Equation, box: {str: (float, float)}, cells: int,
+                  surface_boxes: [{str: (float, float)}] = None) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Vertices, vertex normals (NaN where there isn't one) and quads (as rows of vertex indices) of equ's
+    surface inside box, split into cells x cells x cells. Every cell the surface passes through gets a vertex
+    where it crosses the cell's edges on average, pulled onto the surface along the gradient, and every grid
+    edge the surface crosses gets a quad joining the 4 cells around it, facing the way lhs - rhs grows.
+    If surface_boxes is given, only the grid points around them are sampled, as the surface can't be elsewhere,
+    unless they cover more than PRUNE_FRACTION of the grid, where picking the points out costs more than it saves.
+    """
+    axes = [np.linspace(*box[var], cells + 1) for var in algebra.VAR_IDX]
+    steps = np.array([axis[1] - axis[0] for axis in axes])
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+
+    # every edge the surface crosses has both ends among the grid points on or just around some surface box
+    near = None
+    if surface_boxes is not None:
+        near = np.zeros((cells + 1,) * 3, dtype=bool)
+        for surface_box in surface_boxes:
+            near[tuple(slice(max(0, math.floor((surface_box[var][0] - box[var][0]) / steps[i])),
+                             min(cells, math.ceil((surface_box[var][1] - box[var][0]) / steps[i])) + 1)
+                       for var, i in algebra.VAR_IDX.items())] = True
+
+    if near is None or near.mean() > PRUNE_FRACTION:
+        values = equ.implicit(grid.reshape(-1, 3))[0].reshape((cells + 1,) * 3)
+    else:
+        values = np.full((cells + 1,) * 3, np.nan)
+        values[near] = equ.implicit(grid[near])[0]
+
+    sums = np.zeros((cells,) * 3 + (3,))
+    counts = np.zeros((cells,) * 3)
+    quads = []
+    for axis in range(3):
+        b, c = (axis + 1) % 3, (axis + 2) % 3
+        low = np.delete(values, -1, axis)  # value at the start of every edge along axis
+        high = np.delete(values, 0, axis)
+        with np.errstate(invalid='ignore'):
+            crossed = np.isfinite(low) & np.isfinite(high) & ((low < 0) != (high < 0))
+        edges = np.nonzero(crossed)
+        along = low[edges] / (low[edges] - high[edges])
+        points = grid[edges] + np.outer(along, np.eye(3)[axis] * steps[axis])
+
+        around = []  # cells around each edge, in order around axis
+        for db, dc in [(-1, -1), (0, -1), (0, 0), (-1, 0)]:
+            cell = list(edges)
+            cell[b] = cell[b] + db
+            cell[c] = cell[c] + dc
+            inside = (cell[b] >= 0) & (cell[b] < cells) & (cell[c] >= 0) & (cell[c] < cells)
+            np.add.at(sums, tuple(index[inside] for index in cell), points[inside])
+            np.add.at(counts, tuple(index[inside] for index in cell), 1)
+            around += [(np.ravel_multi_index([np.clip(index, 0, cells - 1) for index in cell], counts.shape),
+                        inside)]
+
+        whole = np.logical_and.reduce([inside for _, inside in around])
+        quad = np.stack([cell[whole] for cell, _ in around], axis=1)
+        rising = low[edges][whole] < 0
+        quad[rising] = quad[rising, ::-1]
+        quads += [quad]
+
+    has_vertex = counts.ravel() > 0
+    cell_vertex = np.cumsum(has_vertex) - 1
+    vertices = sums.reshape(-1, 3)[has_vertex] / counts.ravel()[has_vertex, None]
+    lows = np.array(np.unravel_index(np.nonzero(has_vertex)[0], counts.shape)).T * steps + grid[0, 0, 0]
+
+    # one newton step onto the surface, kept just inside the vertex's cell so no two cells' vertices meet
+    with np.errstate(all='ignore'):
+        value, gradient = equ.implicit(vertices)
+        step = gradient * (value / np.einsum('ij,ij->i', gradient, gradient))[:, None]
+        pulled = np.clip(vertices - step, lows + CELL_INSET * steps, lows + (1 - CELL_INSET) * steps)
+        vertices = np.where(np.isfinite(pulled), pulled, vertices)
+
+        gradient = equ.implicit(vertices)[1]
+        normals = gradient / np.linalg.norm(gradient, axis=1)[:, None]
+        normals[~np.isfinite(normals).all(axis=1)] = np.nan
+
+    # vertices pulled into the same spot can leave a quad's first three corners in a line, which would give it
+    # no normal, so each quad starts from the corner whose neighbors make the biggest cross product with it
+    quads = cell_vertex[np.concatenate(quads)].reshape(-1, 4)
+    rolls = (np.arange(4) + np.arange(4)[:, None]) % 4
+    areas = np.stack([np.linalg.norm(np.cross(vertices[quads[:, roll[0]]] - vertices[quads[:, roll[1]]],
+                                              vertices[quads[:, roll[2]]] - vertices[quads[:, roll[1]]]), axis=1)
+                      for roll in rolls], axis=1)
+    quads = quads[np.arange(len(quads))[:, None], rolls[np.argmax(areas, axis=1)]]
+    return vertices, normals, quads[areas.max(axis=1) > 0]
+
+
+def _cell_directions(angle_step: float) -> ([geometry.Vector], [[int]]):
+    """
+    The directions of the rays through the corners of every cell, welded so each is given once, and for
+    each cell the indices of its corners' directions. The directions are a grid, each turned theta_xy then
+    theta_yz from straight up y, and every cell's corners are grid directions, so the cells meet edge to edge.
+    """
+    # be warned, this algorithm will be inaccurate b/c adding to desired values
+    directions = geometry.VertexWelder(DIRECTION_TOLERANCE)
+    point = geometry.Vector(0, 1, 0).unit_vector()  # it already is a unit vector, but in case I change it
+
+    rotate_xy = geometry.rotate_matrix(angle_step, 0, 0)
+    rotate_yz = geometry.rotate_matrix(0, angle_step, 0)
+
+    steps = 0
+    theta = 0
+    while theta < REVOLUTION:
+        steps += 1
+        theta += angle_step
+
+    # one step past a revolution each way, so the last cells close up with the first
+    grid = []
+    for _ in range(steps + 1):
+        row = []
+        corner = point  # rotating makes a new vector, so point itself doesn't change
+        for _ in range(steps + 1):
+            row += [directions.add(corner)]
+            corner = _matrix_times_a_vector(rotate_yz, corner)
+        grid += [row]
+        point = _matrix_times_a_vector(rotate_xy, point)
+
+    cells = [[grid[xy][yz], grid[xy + 1][yz], grid[xy + 1][yz + 1], grid[xy][yz + 1]]
+             for xy in range(steps) for yz in range(steps)]
+    return directions.vertices, cells
+
+
+def _facing_out(indices: [int], vertices: [geometry.Vector]) -> [int]:
+    """
+    A ray mesh face's corner indices, in an order going the same way round the same polygon, whose normal
+    (from the first three corners, like Plane's) points away from the origin the rays were cast from, out of
+    the surface around it. A twisted face has corners facing both ways, so it's started from one facing out.
+    """
+    corners = [vertices[i] for i in indices]
+    outward = geometry.Vector(sum(v.x for v in corners), sum(v.y for v in corners), sum(v.z for v in corners))
+    for order in [indices, indices[::-1]]:
+        for start in range(len(order)):
+            first, second, third = [vertices[i] for i in (order[start:] + order[:start])[:3]]
+            if first.minus(second).cross_product(third.minus(second)).dot_product(outward) > 0:
+                return order[start:] + order[:start]
+    return indices
+
+
+_worker_object = None  # each worker process's Object3D, with the parts' Equations compiled there
+
+
+def _init_worker(parts: [(str, [str])], tolerance: float) -> None:
+    """ Compiles the parts, given as equation strings, once in a worker process. """
+    global _worker_object
+    _worker_object = Object3D.__new__(Object3D)  # only to cast rays, so without building a mesh
+    _worker_object.parts = [Part(algebra.Equation(equ), Boundary([algebra.Equation(eqn) for eqn in eqns]))
+                            for equ, eqns in parts]
+    _worker_object.tolerance = tolerance
+
+
+def _cast_rays_on_worker(chunk: (int, [geometry.Vector])) -> [tuple or None]:
+    return _worker_object._cast_rays(*chunk)
+
+
 class Object3D:
-    def __init__(self, parts: [Part], divisor: int) -> None:  # only takes xyz
+    def __init__(self, parts: [Part], divisor: int, tolerance: float = TOLERANCE, workers: int = 1,
+                 mesher: str = 'rays', cache_dir: str = None, incremental_sort: bool = True,
+                 levels: int = 1, progressive: bool = False) -> None:  # only takes xyz, workers=None for one per cpu
+        if mesher not in MESHERS:
+            raise MesherError(f'Mesher must be one of {MESHERS}, not {mesher!r}.')
         self.parts = parts
-        self.faces = self._new_faces(REVOLUTION / divisor)
-        self._update_faces()
+        self.tolerance = tolerance
+        self.workers = workers or os.cpu_count() or 1
+        self.orientation = geometry.Rotation()  # every rotation so far, applied to the faces as they were built
+
+        # levels of detail, from divisor for the finest (level 0) down to halving it for each coarser one
+        self.level = 0
+        self._divisors = [max(1, divisor // 2 ** level) for level in range(levels)]
+        self._model_meshes = [geometry.Mesh.from_faces([], [])] * levels
+        self._built = [False] * levels
+        self._model_mesh = None  # the one of _model_meshes being turned
+        self._mesh = None  # the model mesh turned by orientation, None until it's needed again
+        self.incremental_sort = incremental_sort
+        self._order = None  # the model mesh's faces in the order they were last drawn
+
+        self._building = self._build(mesher, cache_dir, progressive)
+        if not progressive:
+            while self.building:
+                self.build_next()
+
+    @property
+    def building(self) -> bool:
+        """ Whether there are levels still to build. """
+        return self._building is not None
+
+    def build_next(self) -> bool:
+        """
+        Builds the next band of cells (or, unless progressive, the next level), returning whether that changed
+        the mesh drawn, which it doesn't for bands of a finer level than the one drawn. Levels are built coarsest
+        first, and until one's done the coarsest is drawn as it grows. Does nothing once every level is built.
+        """
+        if self._building is None:
+            return False
+        drawn = self._usable_mesh()
+        try:
+            next(self._building)
+        except StopIteration:
+            self._building = None
+        return self._usable_mesh() is not drawn
+
+    def _build(self, mesher: str, cache_dir: str or None, progressive: bool) -> iter:
+        """ Loads or makes each level's mesh (saving it in cache_dir), yielding after every band if progressive. """
+        for level in reversed(range(len(self._divisors))):
+            path = None
+            mesh = None
+            if cache_dir is not None:
+                path = os.path.join(cache_dir, _mesh_key(self.parts, self._divisors[level], self.tolerance, mesher))
+                mesh = geometry.Mesh.load(path)
+
+            if mesh is None:
+                # faces index into the shared vertices, so a corner shared by neighboring faces is stored once
+                if mesher == 'grid':
+                    mesh = self._new_grid_mesh(self._divisors[level])
+                else:
+                    drawn = progressive and not any(self._built)  # drawn as it grows, until it's done
+                    mesh = geometry.Mesh.from_faces([], [])  # no parts, no bands
+                    faces = [], [], [], False
+                    for faces in self._new_faces(REVOLUTION / self._divisors[level]):
+                        if drawn:  # only the band's new vertices and faces are added to what's there
+                            vertices, face_indices, vertex_normals, closed = faces
+                            mesh = mesh.extended(geometry.Mesh.from_faces(
+                                vertices[len(mesh.vertices):], face_indices[len(mesh):],
+                                vertex_normals[len(mesh.vertices):], closed))
+                            self._model_meshes[level] = mesh
+                        if progressive:
+                            yield
+                    if not drawn:
+                        mesh = geometry.Mesh.from_faces(*faces)
+
+                if path is not None:
+                    try:
+                        os.makedirs(cache_dir, exist_ok=True)
+                        mesh.save(path)
+                    except OSError:  # the cache is only to save time, so the mesh is fine without it
+                        pass
+
+            self._model_meshes[level] = mesh
+            self._built[level] = True
+            yield
+
+    def _usable_mesh(self) -> geometry.Mesh:
+        """ The model mesh at self.level, or until that's built, the finest built one or the coarsest so far. """
+        if self._built[self.level]:
+            return self._model_meshes[self.level]
+        built = [mesh for mesh, is_built in zip(self._model_meshes, self._built) if is_built]
+        return built[0] if built else self._model_meshes[-1]
+
+    @property
+    def mesh(self) -> geometry.Mesh:
+        """
+        The mesh turned by every rotation so far. Rotations only build up orientation, so the vertices are
+        turned (and the faces sorted) once, when they're next needed, however many rotations came before.
+        """
+        model_mesh = self._usable_mesh()
+        if model_mesh is not self._model_mesh:  # another level, or more of one being built
+            if self._mesh is not None and model_mesh.grown_from is self._model_mesh:
+                self._grow_mesh(model_mesh)
+            else:
+                self._mesh = None
+                self._order = None
+            self._model_mesh = model_mesh
+
+        if self._mesh is None:
+            self._model_mesh.centroids  # worked out once, then turned along with the vertices to sort by
+            self._mesh = self._model_mesh.transformed(self.orientation.matrix)
+            self._update_faces()
+        return self._mesh
+
+    @property
+    def faces(self) -> [geometry.Face]:
+        """ The mesh as it's currently turned, as separate Faces in drawing order. """
+        return self.mesh.to_faces()
 
     def rotate(self, theta_xy, theta_yz, theta_xz):
-        rotate = geometry.rotate_matrix(theta_xy, theta_yz, theta_xz)
-        for i, face in enumerate(self.faces):
-            corners = []
-            for corner in face.corners:
-                rotated_corner = _matrix_times_a_vector(rotate, corner)
-                corners += [rotated_corner]
-            self.faces[i] = geometry.Face(corners)
-        self._update_faces()
+        # the mesh is turned from how it was built when next needed, so rounding doesn't pile up
+        self.orientation.rotate(theta_xy, theta_yz, theta_xz)
+        self._mesh = None
 
     # def _new_planes(self, boundary, divisor) -> [str]:  # ex. 'x=1'
     #     return
@@ -93,109 +440,268 @@ class Object3D:
     #                     faces += [geometry.Face(corners)]  # could add center here using equation
     #     return faces
 
-    def _new_faces(self, angle_step) -> [geometry.Face]:
-        # be warned, this algorithm will be inaccurate b/c adding to desired values
-        faces = []
-        point = geometry.Vector(0, 1, 0).unit_vector()  # it already is a unit vector, but in case I change it
-        a = copy.deepcopy(point)
-
-        rotate_xy = geometry.rotate_matrix(angle_step, 0, 0)
-        rotate_yz = geometry.rotate_matrix(0, angle_step, 0)
-
+    def _new_grid_mesh(self, cells: int) -> geometry.Mesh:
+        """
+        Each part dual contoured over its boundary box split into cells x cells x cells (see _dual_contour).
+        Unlike casting rays, it meshes folds and separate sheets, at a cost set by cells alone, less what
+        surface_cells rules out once the cells are fine enough for that to be worth it.
+        """
+        vertices, vertex_normals, faces = [np.empty((0, 3))], [np.empty((0, 3))], [np.empty((0, 4), dtype=np.intp)]
+        closed = bool(self.parts)
+        depth = min(OCTREE_DEPTH, max(0, int(math.log2(cells / OCTREE_CELLS))))
         for part in self.parts:
-            theta_xy = 0
-            while theta_xy < REVOLUTION:
-                theta_yz = 0
-                while theta_yz < REVOLUTION:
-                    corners = []
-                    for xy_coef, yz_coef in [(0, 0), (1, 0), (1, 1), (0, 1)]:
-                        corner = copy.deepcopy(point)
-
-                        corner_rotate_xy = geometry.rotate_matrix(xy_coef * angle_step, 0, 0)
-                        corner_rotate_yz = geometry.rotate_matrix(0, yz_coef * angle_step, 0)
-
-                        corner = _matrix_times_a_vector(corner_rotate_xy, corner)
-                        corner = _matrix_times_a_vector(corner_rotate_yz, corner)
-
-                        orig_func_signs, orig_bound_signs = self.get_signs(part, corner)
-
-                        print(corner.angle_between_vectors(a))
-
-                        while True:
-                            corner = corner.plus(corner.unit_vector().times(MAGNITUDE_STEP))
-                            # assuming no folds, spirals, etc from a single function
-                            try:
-                                func_signs, bound_signs = self.get_signs(part, corner)
-                                if bound_signs != orig_bound_signs:
-                                    # won't add points at bound for given func
-                                    break  # don't add points past here
-                                if func_signs != orig_func_signs:
-                                    corners += [corner]
-                                    break  # don't add points past here
-                            except ValueError:  # not on graph, but further points may be, up until boundary
-                                continue
-
-                    if len(corners) >= 3:
-                        faces += [geometry.Face(corners)]
-
-                    point = _matrix_times_a_vector(rotate_yz, point)
-                    theta_yz += angle_step
-
-                point = _matrix_times_a_vector(rotate_xy, point)
-                theta_xy += angle_step
-
-        return faces
+            part_vertices, part_normals, part_faces = _dual_contour(part.equ, boundary_box(part.bound), cells,
+                                                                    self.surface_cells(part, depth))
+            part_mesh = geometry.Mesh(part_vertices, part_faces, np.full(len(part_faces), 4, dtype=np.intp))
+            if not part_mesh.winds_closed():
+                closed = False
+            elif part_mesh.volume() < 0:  # lhs - rhs grows inward, so the quads face in
+                part_faces = part_faces[:, ::-1]
+
+            faces += [part_faces + sum(len(previous) for previous in vertices)]
+            vertices += [part_vertices]
+            vertex_normals += [part_normals]
+
+        faces = np.concatenate(faces)
+        return geometry.Mesh(np.concatenate(vertices), faces, np.full(len(faces), 4, dtype=np.intp),
+                             np.concatenate(vertex_normals), closed)
+
+    def _new_faces(self, angle_step) -> iter:
+        """
+        Yields the vertices welded within self.tolerance, for each face the indices of its corners (facing out),
+        the vertices' normals, and whether the mesh is closed, after each band of cells, so the last is the whole
+        mesh (the lists grow in place). It's closed once every ray has hit, as a surface every ray from the origin
+        hits surrounds it, and never until the last band.
+        Neighboring faces share the rays through their common corners, so each ray is cast once, in chunks
+        across self.workers processes if there's more than one. The hits are merged in cell order, so the
+        mesh comes out the same however the rays were split.
+        """
+        directions, cells = _cell_directions(angle_step)
+        vertices = geometry.VertexWelder(self.tolerance)
+        vertex_normals = []
+        face_indices = []
+        # the angles go round every direction twice, so each cell's corners come up twice, the second time in
+        # mirrored order, and only the first is kept, else each face would be drawn twice over itself
+        seen = set()
+        missed = False  # whether a ray has missed, leaving a hole
+
+        pool = None
+        if self.workers > 1:
+            parts = [(part.equ.equation, [equ.equation for equ in part.bound.eqns]) for part in self.parts]
+            pool = multiprocessing.Pool(self.workers, _init_worker, (parts, self.tolerance))
+        try:
+            for part_index in range(len(self.parts)):
+                hits = {}  # direction index: what its ray hit, for the rays cast so far
+                for start in range(0, len(cells), BAND_CELLS * self.workers):
+                    band = cells[start:start + BAND_CELLS * self.workers]
+                    new = sorted({direction for cell in band for direction in cell} - hits.keys())
+                    hits.update(zip(new, self._cast_band(part_index, [directions[i] for i in new], pool)))
+                    missed = missed or any(hits[direction] is None for direction in new)
+
+                    for cell in band:
+                        indices = []
+                        for hit in [hits[direction] for direction in cell if hits[direction] is not None]:
+                            index = vertices.add(geometry.Vector(*hit[0]))
+                            if index == len(vertex_normals):
+                                vertex_normals += [None if hit[1] is None else geometry.Vector(*hit[1])]
+                            if index not in indices:
+                                indices += [index]
+
+                        if len(indices) >= 3 and frozenset(indices) not in seen:
+                            seen.add(frozenset(indices))
+                            face_indices += [_facing_out(indices, vertices.vertices)]
+                    last = part_index == len(self.parts) - 1 and start + len(band) == len(cells)
+                    yield vertices.vertices, face_indices, vertex_normals, last and not missed
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def _cast_band(self, part_index: int, directions: [geometry.Vector],
+                   pool: multiprocessing.Pool or None) -> [((float, float, float), tuple) or None]:
+        """ _cast_rays for directions, split into chunks across pool's workers if there is a pool. """
+        if pool is None:
+            return self._cast_rays(part_index, directions)
+
+        chunk_size = max(1, math.ceil(len(directions) / (self.workers * CHUNKS_PER_WORKER)))
+        chunks = [(part_index, directions[start:start + chunk_size]) for start in range(0, len(directions), chunk_size)]
+        return list(itertools.chain.from_iterable(pool.map(_cast_rays_on_worker, chunks)))
+
+    def _cast_rays(self, part_index: int, directions: [geometry.Vector]) -> [((float, float, float), tuple) or None]:
+        """ For each direction, the (vertex, vertex normal) its ray hits part at as tuples, or None if it misses. """
+        part = self.parts[part_index]
+        hits = []
+        for direction in directions:
+            vertex = self._cast_ray(part, direction)
+            if vertex is None:
+                hits += [None]
+            else:
+                normal = self._vertex_normal(part, vertex)
+                hits += [((vertex.x, vertex.y, vertex.z), None if normal is None else (normal.x, normal.y, normal.z))]
+        return hits
+
+    def _cast_ray(self, part: Part, start: geometry.Vector) -> geometry.Vector or None:
+        """
+        Marches outward from start in steps of MAGNITUDE_STEP, RAY_CHUNK steps per batch, to bracket
+        where part's func signs first change, then returns that point refined to within self.tolerance,
+        or None if a bound's signs change first.
+        """
+        # assuming no folds, spirals, etc from a single function
+        start_point = np.array([start.x, start.y, start.z])
+        orig_func_signs, orig_bound_signs = self.get_signs_array(part, start_point)
+        direction = start_point / start.magnitude
+
+        steps = np.arange(1, RAY_CHUNK + 1)
+        while True:
+            points = start_point + np.outer(steps * MAGNITUDE_STEP, direction)
+            func_signs, bound_signs = self.get_signs_array(part, points)
+
+            func_change = _first_change(func_signs, orig_func_signs)
+            bound_change = _first_change(bound_signs, orig_bound_signs)
+            if bound_change is not None and (func_change is None or bound_change <= func_change):
+                return None  # won't add points at or past bound for given func
+            if func_change is not None:
+                high = start.magnitude + int(steps[func_change]) * MAGNITUDE_STEP
+                direction = tuple(direction.tolist())
+                return self._refine_crossing(part, direction, high - MAGNITUDE_STEP, high, orig_func_signs[0])
+            steps += RAY_CHUNK
+
+    def _refine_crossing(self, part: Part, direction: (float, float, float),
+                         low: float, high: float, orig_func_signs: np.ndarray) -> geometry.Vector:
+        """
+        Narrows down [low, high], magnitudes along direction where part's func signs are still orig_func_signs
+        at low but not at high, until it's within self.tolerance. Takes Newton steps on the func that changed
+        using its analytic gradient, false position (Illinois) steps when a Newton step would leave [low, high],
+        and bisects when neither works (ex. around the edge of a sqrt, where the func is invalid past it).
+        """
+        residuals_low = _func_residuals(part.equ, _along(direction, low))
+        residuals_high = _func_residuals(part.equ, _along(direction, high))
+        i = next((i for i, residual in enumerate(residuals_high) if not _same_signs([residual], orig_func_signs[i:])),
+                 None)
+        if i is None:  # only the array evaluation saw the change, from a residual right at 0
+            return geometry.Vector(*_along(direction, high))
+        r_low, r_high = residuals_low[i], residuals_high[i]
+        last, r_last = (low, r_low) if abs(r_low) < abs(r_high) else (high, r_high)
+
+        kept = None  # which end stayed put last step
+        for _ in range(MAX_REFINE_STEPS):
+            if high - low <= self.tolerance:
+                break
+
+            magnitude = _newton_step(part.equ, i, direction, last, r_last)
+            if magnitude is not None and low < magnitude < high:
+                if abs(magnitude - last) <= self.tolerance:
+                    return geometry.Vector(*_along(direction, magnitude))
+            elif math.isfinite(r_low) and math.isfinite(r_high) and r_low * r_high < 0:
+                magnitude = high - r_high * (high - low) / (r_high - r_low)
+                if not low < magnitude < high:
+                    magnitude = (low + high) / 2
+            else:
+                magnitude = (low + high) / 2
+
+            residuals = _func_residuals(part.equ, _along(direction, magnitude))
+            if residuals[i] == 0:
+                return geometry.Vector(*_along(direction, magnitude))
+
+            if _same_signs(residuals, orig_func_signs):
+                low, r_low = magnitude, residuals[i]
+                if kept == 'high':
+                    r_high /= 2
+                kept = 'high'
+            else:
+                high, r_high = magnitude, residuals[i]
+                if kept == 'low':
+                    r_low /= 2
+                kept = 'low'
+            last, r_last = magnitude, residuals[i]
+
+        return geometry.Vector(*_along(direction, (low + high) / 2))
+
+    def _vertex_normal(self, part: Part, corner: geometry.Vector) -> geometry.Vector or None:
+        """ Unit gradient of the func corner is on (closest to 0), or None if it isn't defined there. """
+        point = corner.x, corner.y, corner.z
+        residuals = [abs(residual) if math.isfinite(residual) else math.inf
+                     for residual in _func_residuals(part.equ, point)]
+        gradient = part.equ.gradients(*point)[residuals.index(min(residuals))]
+        if not all(math.isfinite(value) for value in gradient):
+            return None
+        try:
+            return geometry.Vector(*gradient).unit_vector()
+        except geometry.ZeroVectorError:
+            return None
+
+    def surface_cells(self, part: Part, depth: int = OCTREE_DEPTH) -> [{str: (float, float)}]:
+        """
+        Cells of part's boundary box, split in 8 depth times, that part's surface might go through.
+        Interval arithmetic rules out every other cell as a whole (along with the cells it'd split
+        into), so they never need to be probed point by point.
+        """
+        cells = []
+        to_split = [(boundary_box(part.bound), depth)]
+        while to_split:
+            box, cell_depth = to_split.pop()
+            if not _may_have_surface(part.equ, box):
+                continue
+            if cell_depth == 0:
+                cells += [box]
+                continue
+
+            halves = [((low, (low + high) / 2), ((low + high) / 2, high)) for low, high in box.values()]
+            for ranges in itertools.product(*halves):
+                to_split += [(dict(zip(box, ranges)), cell_depth - 1)]
+        return cells
+
+    def get_signs_array(self, part: Part, points: np.ndarray) -> (np.ndarray, np.ndarray):
+        """ Array version of get_signs for an N x 3 block of points, with NaN instead of None for invalid. """
+        func_signs = part.equ.signs(points)
+        bound_signs = np.hstack([bound_equ.signs(points) for bound_equ in part.bound.eqns])
+        return func_signs, bound_signs
 
     def get_signs(self, part: Part, corner: geometry.Vector) -> ([int], [int]):
         func_signs = []
         bound_signs = []
         x, y, z = corner.x, corner.y, corner.z
 
-        for obj_func in part.equ.funcs:
-            try:
-                func_signs += [sign(eval(f'corner.{part.equ.var_out} - ({obj_func})'))]
-            except ValueError:
-                # None is place holder for invalid, hopefully also changes when passing (all?) surfaces
-                func_signs += [None]
+        var_out = getattr(corner, part.equ.var_out)
+        for value in part.equ.evaluate_funcs(x, y, z):
+            # None is place holder for invalid (nan), hopefully also changes when passing (all?) surfaces
+            func_signs += [None if math.isnan(value) else sign(var_out - value)]
 
         for bound_equ in part.bound.eqns:
-            for bound_func in bound_equ.funcs:
-                try:
-                    bound_signs += [sign(eval(f'corner.{bound_equ.var_out} - ({bound_func})'))]
-                except ValueError:
-                    bound_signs += [None]
+            var_out = getattr(corner, bound_equ.var_out)
+            for value in bound_equ.evaluate_funcs(x, y, z):
+                bound_signs += [None if math.isnan(value) else sign(var_out - value)]
 
         return func_signs, bound_signs
 
     def _calc_coordinates(self, x_plane, y_plane, function, boundary):
         x, y = x_plane.value, y_plane.value
-        z = eval(function)
+        z = function(x, y, 0)  # a solved func like those in Equation.evaluate_funcs, z is the var being solved for
 
         if z <= boundary.min_z or boundary.max_z <= z:
             raise ValueError
 
         return x, y, z
 
-    def _sort_faces(self, faces: [str], low: int, high: int) -> None:
-        """ From https://www.geeksforgeeks.org/python-program-for-quicksort/ """
-        if low < high:
-            pi = self._partition(faces, low, high)
-
-            self._sort_faces(faces, low, pi - 1)
-            self._sort_faces(faces, pi + 1, high)
-
-    def _partition(self, faces: [str], low: int, high: int) -> int:
-        """ From https://www.geeksforgeeks.org/python-program-for-quicksort/ """
-        i = low - 1
-        pivot = self.faces[high].corners[0].z
-
-        for j in range(low, high):
-            if self.faces[j].corners[0].z <= pivot:
-                i += 1
-                faces[i], faces[j] = faces[j], faces[i]
-
-        faces[i + 1], faces[high] = faces[high], faces[i + 1]
-        return i + 1
+    def _grow_mesh(self, model_mesh: geometry.Mesh) -> None:
+        """
+        Adds the faces model_mesh adds to the model mesh being turned onto the end of the turned mesh, turning
+        just them, then sorts them in among the rest, which are still in order.
+        """
+        start, vertex_start = len(self._model_mesh), len(self._model_mesh.vertices)
+        more = geometry.Mesh(model_mesh.vertices[vertex_start:], model_mesh.faces[start:],
+                             model_mesh.corner_counts[start:], model_mesh.vertex_normals[vertex_start:],
+                             model_mesh.closed, centroids=model_mesh.centroids[start:])
+        self._mesh = self._mesh.extended(more.transformed(self.orientation.matrix))
+        order = np.argsort(self._mesh.centroids[:, 2], kind='stable')
+        self._order = np.concatenate([self._order, np.arange(start, len(model_mesh))])[order]
+        self._mesh.reorder(order)
 
     def _update_faces(self):
-        self._sort_faces(self.faces, 0, len(self.faces) - 1)
+        # sorts the mesh's faces by their centroids' z. From one frame to the next the order barely changes, so
+        # incrementally the last order is re-sorted, which a stable (merging) sort does in close to linear time
+        depths = self._mesh.centroids[:, 2]
+        if self.incremental_sort and self._order is not None:
+            self._order = self._order[np.argsort(depths[self._order], kind='stable')]
+        else:
+            self._order = np.argsort(depths, kind='stable')
+        self._mesh.reorder(self._order)
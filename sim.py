@@ -1,5 +1,7 @@
 import pygame
 import math
+import os
+import numpy as np
 import collections
 import object3d
 import geometry
@@ -28,6 +30,7 @@ ORANGE = 255, 122, 0
 BACKGROUND_COLOR = ORANGE
 
 IS_ORTHOGONAL = False
+NEAR_DIST = 1  # how close to the eye a corner can get and still be drawn
 MIN_DISTANCE = -50
 CHANGE_DIST = 50
 
@@ -38,6 +41,13 @@ ROTATE_STEP = PI / 16
 LIGHT_VECTOR = geometry.Vector(0, 0, 1)
 
 DIVISOR = 40
+LOD_LEVELS = 2  # the coarsest is drawn while rotating, the finest (DIVISOR) once rotating stops
+IDLE_TIME = 250  # ms without rotating before the finest level is drawn
+PROGRESSIVE = True  # open the window right away and build the mesh a band a frame, drawing it as it fills in
+WORKERS = None  # processes building the mesh, None for one per cpu
+MESHER = 'rays'  # or 'grid', for surfaces that fold or come in separate sheets (saddle, hyperboloids)
+# meshes made before are loaded from here instead of made again, None to not
+MESH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.mesh_cache')
 BOUND = 600
 RADIUS = 200
 SCALE = 100
@@ -79,14 +89,18 @@ FRAME_RATE = 30
 class Simulation3D:
     def __init__(self):
         self._running = True
-        self._object = object3d.Object3D([object3d.Part(EQUATION, BOUNDARY)], DIVISOR)
+        self._object = object3d.Object3D([object3d.Part(EQUATION, BOUNDARY)], DIVISOR, workers=WORKERS,
+                                           mesher=MESHER, cache_dir=MESH_CACHE_DIR,
+                                           levels=LOD_LEVELS, progressive=PROGRESSIVE)
         self._clock = pygame.time.Clock()
         self._angle = 0
         self._this_rel = (0, 0)
         self._since_last_rel = (0, 0)
         self._screen_size = (SCREEN_WIDTH, SCREEN_HEIGHT)
         self._center = geometry.Vector(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, 0)
-        self._trans_surface = None
+        self._trans_surface = None  # made again only when the window is resized
+        self._last_rotation = -IDLE_TIME  # ms since pygame.init() when the object was last rotated
+        self._dirty = True  # whether anything's changed since the last frame was drawn
 
     def run(self):
         pygame.init()
@@ -100,12 +114,17 @@ class Simulation3D:
             self._handle_events()
             self._handle_mouse_clicks()
             self._handle_keys()
+            if self._object.build_next():
+                self._dirty = True
+            self._pick_level()
             self._redraw()
         pygame.quit()
 
     def _resize_surface(self) -> None:
         pygame.display.set_mode(self._screen_size, pygame.RESIZABLE)
         self._center = geometry.Vector(self._screen_size[0] / 2, self._screen_size[1] / 2, 0)
+        self._trans_surface = pygame.Surface(self._screen_size, pygame.SRCALPHA)
+        self._dirty = True
 
     def _handle_events(self) -> None:
         for event in pygame.event.get():
@@ -116,34 +135,37 @@ class Simulation3D:
                 self._screen_size = event.size
                 self._resize_surface()
 
+            elif event.type == pygame.VIDEOEXPOSE:
+                self._dirty = True
+
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_a:
-                    self._object.rotate(0, 0, -PI / 2)
+                    self._rotate(0, 0, -PI / 2)
                 elif event.key == pygame.K_d:
-                    self._object.rotate(0, 0, PI / 2)
+                    self._rotate(0, 0, PI / 2)
                 elif event.key == pygame.K_w:
-                    self._object.rotate(0, -PI / 2, 0)
+                    self._rotate(0, -PI / 2, 0)
                 elif event.key == pygame.K_s:
-                    self._object.rotate(0, PI / 2, 0)
+                    self._rotate(0, PI / 2, 0)
 
     def _handle_keys(self):
         if pygame.key.get_pressed()[pygame.K_LEFT]:
-            self._object.rotate(0, 0, ROTATE_STEP)
+            self._rotate(0, 0, ROTATE_STEP)
 
         if pygame.key.get_pressed()[pygame.K_RIGHT]:
-            self._object.rotate(0, 0, -ROTATE_STEP)
+            self._rotate(0, 0, -ROTATE_STEP)
 
         if pygame.key.get_pressed()[pygame.K_UP]:
-            self._object.rotate(0, ROTATE_STEP, 0)
+            self._rotate(0, ROTATE_STEP, 0)
 
         if pygame.key.get_pressed()[pygame.K_DOWN]:
-            self._object.rotate(0, -ROTATE_STEP, 0)
+            self._rotate(0, -ROTATE_STEP, 0)
 
         if pygame.key.get_pressed()[pygame.K_l]:
-            self._object.rotate(-ROTATE_STEP, 0, 0)
+            self._rotate(-ROTATE_STEP, 0, 0)
 
         if pygame.key.get_pressed()[pygame.K_j]:
-            self._object.rotate(ROTATE_STEP, 0, 0)
+            self._rotate(ROTATE_STEP, 0, 0)
 
         if pygame.key.get_pressed()[pygame.K_n]:
             pass
@@ -173,40 +195,81 @@ class Simulation3D:
             if x - max_length < mx < x + max_length and y - max_length < my < y + max_length:
                 theta_yz = self._this_rel[1] * scale
                 theta_xz = self._this_rel[0] * scale
-                self._object.rotate(0, theta_yz, theta_xz)
+                self._rotate(0, theta_yz, theta_xz)
             else:
                 theta_xy = (self._this_rel[0] * sin_pos + self._this_rel[1] * cos_pos) * scale / 2
-                self._object.rotate(theta_xy, 0, 0)
+                self._rotate(theta_xy, 0, 0)
 
             self._handle_events()
 
+    def _rotate(self, theta_xy, theta_yz, theta_xz):
+        if theta_xy or theta_yz or theta_xz:  # ex. the mouse held down without moving
+            self._object.rotate(theta_xy, theta_yz, theta_xz)
+            self._last_rotation = pygame.time.get_ticks()
+            self._dirty = True
+
+    def _pick_level(self):
+        # coarse while rotating so frames keep up, fine once it stops
+        rotating = pygame.time.get_ticks() - self._last_rotation < IDLE_TIME
+        level = LOD_LEVELS - 1 if rotating else 0
+        if level != self._object.level:
+            self._object.level = level
+            self._dirty = True
+
     def _redraw(self):
+        # nothing's moved, been built or been resized, so what's on screen is still right
+        if not self._dirty:
+            return
+
         surface = pygame.display.get_surface()
         surface.fill(BACKGROUND_COLOR)
-        self._trans_surface = pygame.Surface(self._screen_size, pygame.SRCALPHA)
+        self._trans_surface.fill((0, 0, 0, 0))
 
         self._draw_object()
 
         surface.blit(self._trans_surface, (0, 0))
         pygame.display.flip()
-
-    def get_face_points(self, face):
-        corners = []
-        for corner in face.corners:
-            corner1 = corner.plus(self._center)
-            corner2 = self._center.minus(corner)
-            corners += [(corner1.x, corner2.y)]
-        return corners
+        self._dirty = False
+
+    def get_screen_points(self, vertices):
+        # every vertex of the mesh to the screen at once, unless orthogonal projected toward the eye (out along +z)
+        # onto the screen (at SCREEN_DIST, where sizes stay the same), with y flipped to go down the screen
+        scale = 1
+        if not IS_ORTHOGONAL:
+            with np.errstate(divide='ignore'):
+                scale = (EYE_DIST - SCREEN_DIST) / (EYE_DIST - vertices[:, 2])
+        return np.column_stack((self._center.x + vertices[:, 0] * scale, self._center.y - vertices[:, 1] * scale))
+
+    def _visible_faces(self, mesh, points):
+        # a closed mesh's faces pointing away from the eye (out along +z) are hidden behind the rest
+        visible = np.ones(len(mesh), dtype=bool)
+        if mesh.closed:
+            toward_eye = (0, 0, 1) if IS_ORTHOGONAL else np.array([0, 0, EYE_DIST]) - mesh.centroids
+            visible &= np.einsum('ij,ij->i', mesh.normals, np.broadcast_to(toward_eye, mesh.normals.shape)) > 0
+
+        # as is any face with a corner behind (or right at) the eye
+        if not IS_ORTHOGONAL:
+            visible &= (mesh.vertices[mesh.faces, 2] < EYE_DIST - NEAR_DIST).all(axis=1)
+
+        # as is any face wholly off the window
+        corners = points[mesh.faces]
+        low, high = corners.min(axis=1), corners.max(axis=1)
+        visible &= (high[:, 0] >= 0) & (low[:, 0] <= self._screen_size[0])
+        visible &= (high[:, 1] >= 0) & (low[:, 1] <= self._screen_size[1])
+        return np.nonzero(visible)[0]
 
     def _draw_object(self):
         surface = pygame.display.get_surface()
-        for face in self._object.faces:
+        mesh = self._object.mesh
+        points = self.get_screen_points(mesh.vertices)
+        for face in self._visible_faces(mesh, points).tolist():
+            face_points = points[mesh.corners(face)].tolist()
             if COLORING:
-                pygame.draw.polygon(surface, BLUE, self.get_face_points(face))
-                pygame.draw.lines(surface, BLACK, True, self.get_face_points(face))
+                pygame.draw.polygon(surface, BLUE, face_points)
+                pygame.draw.lines(surface, BLACK, True, face_points)
             if SHADING:
                 # alpha = center_to_sub_face.angle_between_vectors(LIGHT_VECTOR) * 255 / math.pi
-                pygame.draw.polygon(surface, BLUE, self.get_face_points(face))
+                pygame.draw.polygon(surface, BLUE, face_points)
 
     def _end_simulation(self):
         self._running = False